@@ -8,30 +8,60 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 's
 
 from scripts.core.movie_analyzer import MovieAnalyzer
 from scripts.core.movie_api import MovieAPI
+from scripts.core.movie_batch import MovieBatch, OpenAIBatchProvider
 from scripts.core.movie_manager import MovieManager
 from scripts.core.movie_main import MovieMain
+from scripts.helpers.checkpoint import Checkpoint
 from scripts.helpers.config import Config
+from scripts.helpers.metrics import metrics
+from scripts.helpers.rate_limiter import DEFAULT_QUOTAS, build_rate_limiters
 from scripts.helpers.supabase_db import SupabaseDB
 
-def initialize():
+def initialize(quotas: dict = None, use_rpc: bool = False, fingerprints: bool = False):
     config = Config('./scripts/config/config.yaml')
+    # Quotas given on the command line win over the ones in the config
+    tmdb_rate_limiter, llm_rate_limiter = build_rate_limiters({key: (quotas or {}).get(key) or config.get(key) for key in DEFAULT_QUOTAS})
     db = SupabaseDB(config.get('supabase_url'), config.get('supabase_key'))
-    movies_api = MovieAPI(config.get('tmdb_api_token'))
-    manager = MovieManager(movies_api, db)
-    return config, db, manager, movies_api
+    movies_api = MovieAPI(config.get('tmdb_api_token'), rate_limiter=tmdb_rate_limiter)
+    manager = MovieManager(movies_api, db, use_rpc=use_rpc, fingerprints=fingerprints or config.get('fingerprints', False))
+    return config, db, manager, movies_api, llm_rate_limiter
 
 def main():
     parser = argparse.ArgumentParser(description="Scan, analyze and save movies")
     parser.add_argument("--year", type=int, default=2021, help="Year of movies to analyze")
+    parser.add_argument("--year-end", type=int, help="Last year of movies to analyze, to stream a range of years")
     parser.add_argument("--page", type=int, default=1, help="Page number for API request")
+    parser.add_argument("--page-end", type=int, help="Last page to analyze of each year, to stream a range of pages (default: all pages in range mode)")
+    parser.add_argument("--min-votes", type=int, help="Minimum number of votes of the movies to analyze")
     parser.add_argument("--overwrite", default=False, action="store_true", help="Overwrite existing movies")
+    parser.add_argument("--incremental", default=False, action="store_true", help="Re-analyze existing movies, running only the tests whose criteria, prompts or model changed")
+    parser.add_argument("--resume", default=False, action="store_true", help="Resume the last run with the same options from its checkpoint journal")
     parser.add_argument("--clear-cache", default=False, action="store_true", help="Clear cache before analysis")
+    parser.add_argument("--test-concurrency", type=int, default=1, help="Number of tests of a movie to run in parallel")
+    parser.add_argument("--movie-concurrency", type=int, default=1, help="Number of movies to analyze in parallel")
+    parser.add_argument("--openai-rpm", type=int, help="Requests per minute allowed to the LLM endpoint (default: openai_rpm in the config, or 500)")
+    parser.add_argument("--openai-tpm", type=int, help="Tokens per minute allowed to the LLM endpoint (default: openai_tpm in the config, or 200000)")
+    parser.add_argument("--tmdb-rpm", type=int, help="Requests per minute allowed to TMDb (default: tmdb_rpm in the config, or 2400)")
+    parser.add_argument("--prefix-caching", default=False, action="store_true", help="Keep the shared conversation prefix identical and warm the provider cache before running tests in parallel")
+    parser.add_argument("--multi-test", default=False, action="store_true", help="Evaluate all the tests of a movie in a single request")
+    parser.add_argument("--single-step", default=False, action="store_true", help="Ask for the final JSON in step 2 instead of a separate formatting step")
+    parser.add_argument("--batch-mode", default=False, action="store_true", help="Analyze offline with the OpenAI Batch API")
+    parser.add_argument("--batch-poll-interval", type=int, default=60, help="Seconds between batch status checks")
+    parser.add_argument("--rpc-writes", default=False, action="store_true", help="Replace results and delete movies through the Postgres functions in scripts/sql/functions.sql")
+    parser.add_argument("--metrics-file", help="Write latency and token metrics in Prometheus text format to this file during and after the run")
+    parser.add_argument("--metrics-port", type=int, help="Serve latency and token metrics in Prometheus text format on this port")
     parser.add_argument("--remote-llm", default=True, action="store_true", help="Use remote LLM")
 
     parser.add_argument("--movie-id", type=int, help="Movie ID to analyze")
     args = parser.parse_args()
 
-    config, _, manager, movies_api = initialize()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.metrics_file:
+        metrics.write_periodically(args.metrics_file)
+
+    quotas = {key: getattr(args, key) for key in DEFAULT_QUOTAS}
+    config, _, manager, movies_api, llm_rate_limiter = initialize(quotas, use_rpc=args.rpc_writes, fingerprints=args.incremental)
 
     def progress_callback(message):
         print(message)
@@ -40,18 +70,48 @@ def main():
         analyzer = MovieAnalyzer(
             api_key=config.get('openai_key'),
             base_url="https://api.openai.com/v1/",
-            model="gpt-4o-mini"
+            model="gpt-4o-mini",
+            rate_limiter=llm_rate_limiter,
+            prefix_caching=args.prefix_caching,
+            single_step=args.single_step,
+            json_mode=True
         )
     else:
-        analyzer = MovieAnalyzer()
+        analyzer = MovieAnalyzer(prefix_caching=args.prefix_caching, single_step=args.single_step)
+
+    # Journal of the run, keyed by the options that select the movies and tests
+    run_params = {key: getattr(args, key) for key in ('year', 'year_end', 'page', 'page_end', 'min_votes', 'movie_id',
+                                                      'overwrite', 'incremental', 'multi_test', 'single_step')}
+    checkpoint = Checkpoint('./cache/checkpoint.sqlite', run_params)
+    if not args.resume:
+        checkpoint.reset()
 
-    analyzer_main = MovieMain(movies_api, manager, analyzer, progress_callback) 
+    analyzer_main = MovieMain(movies_api, manager, analyzer, progress_callback,
+                              test_concurrency=args.test_concurrency,
+                              movie_concurrency=args.movie_concurrency,
+                              multi_test=args.multi_test,
+                              incremental=args.incremental,
+                              checkpoint=checkpoint)
 
     if args.movie_id:
         analyzer_main.analyze_single_movie(args.movie_id, args.overwrite)
+    elif args.batch_mode:
+        provider = OpenAIBatchProvider(analyzer.api_key, analyzer.base_url, args.batch_poll_interval, log=progress_callback)
+        batch = MovieBatch(analyzer, provider, log=progress_callback)
+        if args.clear_cache:
+            analyzer.clear_cache()
+            movies_api.clear_cache()
+        analyzer_main.analyze_movies_batch(args.year, args.page, args.overwrite, batch)
+    elif args.year_end or args.page_end or args.min_votes:
+        years = range(args.year, (args.year_end or args.year) + 1)
+        max_pages = args.page_end - args.page + 1 if args.page_end else None
+        analyzer_main.analyze_movie_range(years, args.page, max_pages, args.min_votes, args.overwrite, args.clear_cache)
     else:
         analyzer_main.analyze_movies(args.year, args.page, args.overwrite, args.clear_cache)
 
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
+
 
 
 if __name__ == "__main__":
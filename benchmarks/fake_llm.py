@@ -0,0 +1,125 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeLLM:
+    def __init__(self, latency: float = 0.5, token_latency: float = 0.0, prompt_tokens: int = None,
+                 completion_tokens: int = 300, cached_ratio: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        """Stand-in for an OpenAI-compatible chat completions endpoint, answering the prompts of MovieAnalyzer.
+
+        Every request waits `latency` seconds plus `token_latency` per completion token, and reports
+        `prompt_tokens` (estimated from the messages if None) and `completion_tokens` as its usage,
+        with `cached_ratio` of the prompt as cached. `error_rate` of the requests fail with a 500.
+        Test results are derived from a hash of the conversation, so runs are repeatable.
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_ratio = cached_ratio
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/v1"
+
+    def serve(self, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the endpoint at http://host:port/v1 from a background thread (any free port by default)."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                status, response = fake.complete(body)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def complete(self, body: dict):
+        """Answer a chat completion request, returning the HTTP status and the response body."""
+        messages = body.get('messages', [])
+        with self.lock:
+            self.requests += 1
+            request_id = self.requests
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        prompt_tokens = self.prompt_tokens
+        if prompt_tokens is None:
+            prompt_tokens = sum(len(str(message.get('content', ''))) for message in messages) // 4
+        time.sleep(self.latency + self.completion_tokens * self.token_latency)
+
+        if failed:
+            return 500, {"error": {"message": "Simulated server error", "type": "server_error"}}
+
+        user_messages = [message for message in messages if message.get('role') == 'user']
+        conversation = "\n".join(str(message.get('content', '')) for message in messages)
+        content = self.reply(str(user_messages[-1].get('content', '')) if user_messages else "", conversation)
+        cached_tokens = int(prompt_tokens * self.cached_ratio)
+        return 200, {
+            "id": f"chatcmpl-fake-{request_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": prompt_tokens + self.completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def reply(self, prompt: str, conversation: str = "") -> str:
+        """Build an answer in the format the last prompt asks for."""
+        if "same keys as the following JSON object" in prompt:
+            texts = json.loads(prompt[prompt.find("{"):prompt.rfind("}") + 1])
+            return json.dumps({key: f"[es] {text}" for key, text in texts.items()}, ensure_ascii=False)
+        if '"translated"' in prompt:
+            return json.dumps({"translated": "Traducción simulada"})
+        if "summary_in_spanish" in prompt:
+            return ("<thinking>Simulated reasoning</thinking>\n<output>Simulated summary.</output>\n"
+                    + json.dumps({"summary_in_spanish": "Resumen simulado."}))
+        if "is_there_information" in prompt:
+            return ("<thinking>Simulated reasoning</thinking>\n<output>Simulated knowledge of the movie.</output>\n"
+                    + json.dumps({"is_there_information": True}))
+        if "Include every test ID" in prompt:
+            answers = {test_id: self.result(conversation + test_id) for test_id in re.findall(r"Test ID (\d+)", prompt)}
+            return f"<thinking>Simulated reasoning</thinking>\n<output>{json.dumps(answers, ensure_ascii=False)}</output>"
+        if "Just the json object" in prompt:
+            return json.dumps(self.result(conversation), ensure_ascii=False)
+        return "<thinking>Simulated step-by-step analysis of the criteria.</thinking>"
+
+    def result(self, conversation: str) -> dict:
+        passed = int(hashlib.sha256(conversation.encode('utf-8')).hexdigest()[:8], 16) % 2 == 0
+        return {
+            "result": passed,
+            "reason": "The movie passes the test" if passed else "The movie does not pass the test",
+            "reason_es": "La película pasa la prueba" if passed else "La película no pasa la prueba",
+        }
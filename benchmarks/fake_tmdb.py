@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'tmdb.json')
+
+class FakeTMDb:
+    def __init__(self, fixtures_path: str = FIXTURES_PATH, latency: float = 0.05):
+        """Stand-in for the TMDb API serving the responses in a fixtures file, each after `latency` seconds.
+
+        The fixtures hold the discover pages by language, year and page, and the details of their movies
+        by language and ID, like the ones recorded with `python benchmarks/fake_tmdb.py --token ...`.
+        The bundled ones are synthetic, shaped like TMDb responses with the fields the pipeline reads.
+        """
+        with open(fixtures_path, 'r', encoding='utf-8') as f:
+            self.fixtures = json.load(f)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/3/"
+
+    def serve(self, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the API at http://host:port/3/ from a background thread (any free port by default)."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, response = fake.respond(self.path)
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json;charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def respond(self, path: str):
+        """Find the recorded response of a request path, returning the HTTP status and the response body."""
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+        url = urlparse(path)
+        endpoint = url.path.split('/3/', 1)[-1].strip('/')
+        query = parse_qs(url.query)
+        # TMDb answers in en-US when no language is given
+        lang = query.get('language', ['en-US'])[0]
+        if endpoint == 'discover/movie':
+            year = query.get('primary_release_date.gte', [''])[0][:4]
+            page = query.get('page', ['1'])[0]
+            pages = self.fixtures['discover'].get(lang, {}).get(year, {})
+            # Pages past the recorded ones come back empty, as past the last page of TMDb
+            return 200, dict(pages.get(page, {'page': int(page), 'results': []}), total_pages=len(pages))
+
+        match = re.fullmatch(r'movie/(\d+)', endpoint)
+        movies = self.fixtures['movies'].get(lang, {})
+        if match and match.group(1) in movies:
+            return 200, movies[match.group(1)]
+        return 404, {'success': False, 'status_code': 34, 'status_message': "The resource you requested could not be found."}
+
+
+def record(token: str, years, pages: int, path: str = FIXTURES_PATH, lang: str = 'es-ES') -> None:
+    """Record the discover pages of some years and the details of their movies from TMDb into a fixtures file.
+
+    Like the analysis, pages are discovered in `lang` and details fetched in en-US, with the translations appended.
+    """
+    from scripts.core.movie_api import MovieAPI
+
+    api = MovieAPI(token, cache_path=None)
+    fixtures = {'discover': {lang: {}}, 'movies': {'en-US': {}}}
+    for year in years:
+        for page in range(1, pages + 1):
+            data = api.make_request(api.discover_endpoint(lang, year, page))
+            fixtures['discover'][lang].setdefault(str(year), {})[str(page)] = data
+            for movie in data['results']:
+                fixtures['movies']['en-US'][str(movie['id'])] = api.fetch_movie_details(movie['id'], title_lang=lang)
+            print(f"Recorded page {page} of {year}: {len(data['results'])} movies")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record TMDb responses as fixtures for the benchmarks")
+    parser.add_argument("--token", required=True, help="TMDb API read access token")
+    parser.add_argument("--year", type=int, default=2021, help="Year of movies to record")
+    parser.add_argument("--year-end", type=int, help="Last year of movies to record")
+    parser.add_argument("--pages", type=int, default=1, help="Number of discover pages to record per year")
+    parser.add_argument("--output", default=FIXTURES_PATH, help="Path of the fixtures file")
+    args = parser.parse_args()
+
+    record(args.token, range(args.year, (args.year_end or args.year) + 1), args.pages, args.output)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from scripts.helpers.metrics import metrics
+from scripts.helpers.supabase_db import SupabaseDB
+
+class MemoryDB(SupabaseDB):
+    # Columns identifying a row when upserting, by table ('id' for the rest)
+    primary_keys = {'movies_genres': ('movie_id', 'genre_id')}
+
+    def __init__(self, tables: dict = None, latency: float = 0.0):
+        """In-memory SupabaseDB, counting the requests a real database would get.
+
+        Every request (including raw queries when executed) waits `latency` seconds, to account
+        for the network round-trip. Embedded resources in selects, e.g. "*, tests(id, name)", are
+        resolved by the <table>_id columns, like PostgREST does with the foreign keys.
+        """
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.latency = latency
+        self.requests = {}
+        self.lock = threading.RLock()
+
+    @property
+    def round_trips(self) -> int:
+        with self.lock:
+            return sum(self.requests.values())
+
+    def request(self, table_name, operation: str) -> None:
+        """Count a request to the database and wait for its round-trip."""
+        with self.lock:
+            key = (str(table_name), operation)
+            self.requests[key] = self.requests.get(key, 0) + 1
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation=operation):
+            time.sleep(self.latency)
+
+    def table(self, table_name) -> list:
+        return self.tables.setdefault(str(table_name), [])
+
+    def create(self, table_name: str, data: dict):
+        self.request(table_name, 'insert')
+        with self.lock:
+            return [self.insert(table_name, row) for row in (data if isinstance(data, list) else [data])]
+
+    def create_or_update(self, table_name: str, data: dict):
+        self.request(table_name, 'upsert')
+        return self.upsert(table_name, data if isinstance(data, list) else [data])
+
+    def bulk_upsert(self, table_name: str, rows: list, on_conflict: str = None, ignore_duplicates: bool = False):
+        if not rows:
+            return []
+        self.request(table_name, 'upsert')
+        return self.upsert(table_name, rows, on_conflict, ignore_duplicates)
+
+    def read(self, table_name: str, query: dict = None, order_by: str = None, desc: bool = False):
+        table = self.raw(table_name).match(query or {})
+        if order_by:
+            table = table.order(order_by, desc=desc)
+        return table.execute().data
+
+    def iter_rows(self, table_name: str, query: dict = None, page_size: int = 1000, columns: str = "*", key: str = "id"):
+        last_key = None
+        while True:
+            table = self.raw(table_name, columns)
+            for column, value in (query or {}).items():
+                table = table.is_(column, 'null') if value is None else table.eq(column, value)
+            if last_key is not None:
+                table = table.gt(key, last_key)
+            rows = table.order(key).limit(page_size).execute().data
+            if not rows:
+                return
+            yield from rows
+            last_key = rows[-1][key]
+            if last_key is None:
+                raise ValueError(f"Cannot page {table_name} by {key}: the key of a row is NULL")
+
+    def raw(self, table_name: str, select: str = "*"):
+        return MemoryQuery(self, table_name, select)
+
+    def update(self, table_name: str, match_query: dict, update_data: dict, in_query: dict = None):
+        self.request(table_name, 'update')
+        with self.lock:
+            rows = [row for row in self.table(table_name) if matches(row, match_query)
+                    and all(row.get(column) in values for column, values in (in_query or {}).items())]
+            for row in rows:
+                row.update(update_data)
+            return [dict(row) for row in rows]
+
+    def delete(self, table_name: str, match_query: dict):
+        self.request(table_name, 'delete')
+        with self.lock:
+            rows = self.table(table_name)
+            deleted = [row for row in rows if matches(row, match_query)]
+            rows[:] = [row for row in rows if not matches(row, match_query)]
+            return deleted
+
+    def rpc(self, function_name: str, params: dict = None):
+        """Run the functions of scripts/sql/functions.sql in memory."""
+        self.request(function_name, 'rpc')
+        params = params or {}
+        with self.lock:
+            if function_name == 'replace_movie_results':
+                for row in self.table('result_test'):
+                    if row['movie_id'] == params['p_movie_id']:
+                        row['active'] = False
+                for result in params['p_results']:
+                    self.insert('result_test', dict(result, movie_id=params['p_movie_id'], active=True, id=None))
+                for movie in self.table('movies'):
+                    if movie['id'] == params['p_movie_id']:
+                        movie.update(params['p_summary'])
+                return None
+            if function_name == 'delete_movie_cascade':
+                found = any(movie['id'] == params['p_movie_id'] for movie in self.table('movies'))
+                for table_name, column in (('result_test', 'movie_id'), ('movies_genres', 'movie_id'), ('movies', 'id')):
+                    self.tables[table_name] = [row for row in self.table(table_name) if row[column] != params['p_movie_id']]
+                return found
+        raise ValueError(f"Unknown function: {function_name}")
+
+    def insert(self, table_name, row: dict) -> dict:
+        """Add a row, numbering it if it has no ID. Call it holding the lock."""
+        row = dict(row)
+        if row.get('id') is None and 'id' in self.primary_keys.get(str(table_name), ('id',)):
+            row['id'] = max((existing['id'] for existing in self.table(table_name)), default=0) + 1
+        self.table(table_name).append(row)
+        return dict(row)
+
+    def upsert(self, table_name, rows: list, on_conflict: str = None, ignore_duplicates: bool = False) -> list:
+        keys = on_conflict.split(',') if on_conflict else self.primary_keys.get(str(table_name), ('id',))
+        saved = []
+        with self.lock:
+            for row in rows:
+                existing = None
+                if all(row.get(key) is not None for key in keys):
+                    existing = next((current for current in self.table(table_name)
+                                     if all(current.get(key) == row[key] for key in keys)), None)
+                if existing is None:
+                    saved.append(self.insert(table_name, row))
+                elif not ignore_duplicates:
+                    existing.update(row)
+                    saved.append(dict(existing))
+        return saved
+
+
+class MemoryQuery:
+    def __init__(self, db: MemoryDB, table_name, select: str = "*"):
+        """Select on a MemoryDB table, with the subset of the PostgREST query builder used by the managers."""
+        self.db = db
+        self.table_name = str(table_name)
+        self.select = select
+        self.filters = []
+        self.order_by = None
+        self.limit_rows = None
+
+    def filter(self, column: str, test):
+        self.filters.append((column, test))
+        return self
+
+    def eq(self, column: str, value):
+        return self.filter(column, lambda current: current == value)
+
+    def in_(self, column: str, values):
+        values = list(values)
+        return self.filter(column, lambda current: current in values)
+
+    def is_(self, column: str, value):
+        return self.filter(column, lambda current: current is None if value == 'null' else current == value)
+
+    def gt(self, column: str, value):
+        return self.filter(column, lambda current: current is not None and current > value)
+
+    def match(self, query: dict):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count: int):
+        self.limit_rows = count
+        return self
+
+    def execute(self):
+        self.db.request(self.table_name, 'select')
+        with self.db.lock:
+            rows = [row for row in self.db.table(self.table_name)
+                    if all(test(row.get(column)) for column, test in self.filters if '.' not in column)]
+            if self.select.replace(" ", "") == "count(*)":
+                return SimpleNamespace(data=[{'count': len(rows)}])
+            if self.order_by:
+                column, desc = self.order_by
+                rows = sorted(rows, key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+            if self.limit_rows is not None:
+                rows = rows[:self.limit_rows]
+            return SimpleNamespace(data=[self.project(self.table_name, row, self.select) for row in rows])
+
+    def project(self, table_name: str, row: dict, select: str) -> dict:
+        """Keep the selected columns of a row, adding the embedded resources."""
+        embeds = re.findall(r'(\w+)\(([^()]*)\)', select)
+        columns = [column.strip() for column in re.sub(r'\w+\([^()]*\)', '', select).split(',') if column.strip()]
+        result = dict(row) if '*' in columns else {column: row.get(column) for column in columns}
+        for name, embed_select in embeds:
+            embed_filters = [(column.split('.', 1)[1], test) for column, test in self.filters if column.startswith(name + '.')]
+            foreign_key = singular(name) + '_id'
+            if foreign_key in row:
+                # Many-to-one, e.g. result_test -> tests
+                target = next((other for other in self.db.table(name) if other['id'] == row[foreign_key]), None)
+                result[name] = self.project(name, target, embed_select) if target is not None else None
+            else:
+                # One-to-many, e.g. movies -> result_test, filtered like PostgREST filters embedded rows
+                back_key = singular(table_name) + '_id'
+                result[name] = [self.project(name, other, embed_select) for other in self.db.table(name)
+                                if other.get(back_key) == row['id']
+                                and all(test(other.get(column)) for column, test in embed_filters)]
+        return result
+
+
+def singular(name: str) -> str:
+    return name[:-1] if name.endswith('s') else name
+
+
+def matches(row: dict, query: dict) -> bool:
+    return all(row.get(column) == value for column, value in query.items())
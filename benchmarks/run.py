@@ -0,0 +1,147 @@
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.fake_tmdb import FIXTURES_PATH, FakeTMDb
+from benchmarks.memory_db import MemoryDB
+from scripts.core.movie_analyzer import MovieAnalyzer
+from scripts.core.movie_api import MovieAPI
+from scripts.core.movie_main import MovieMain
+from scripts.core.movie_manager import MovieManager
+
+TESTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'config', 'tests.yaml')
+
+class TimedMovieMain(MovieMain):
+    """MovieMain recording how long each analyzed movie takes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.movie_seconds = []
+        self.timing_lock = threading.Lock()
+
+    def process_movie(self, movie, overwrite_movies, tests_list):
+        start_time = time.perf_counter()
+        analyzed_movie = super().process_movie(movie, overwrite_movies, tests_list)
+        if analyzed_movie is not None:
+            with self.timing_lock:
+                self.movie_seconds.append(time.perf_counter() - start_time)
+        return analyzed_movie
+
+
+def load_tests(path: str = TESTS_PATH) -> list:
+    """Rows of the tests table, using the description of each test as its criteria."""
+    with open(path, 'r', encoding='utf-8') as f:
+        tests = yaml.safe_load(f)
+    return [dict(test, criteria=test['description']) for test in tests]
+
+
+def percentile(values: list, percent: float) -> float:
+    """Nearest-rank percentile, or 0 without values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def run(args) -> dict:
+    """Analyze the fixture movies against the fake services and measure the run."""
+    llm = FakeLLM(latency=args.llm_latency, token_latency=args.llm_token_latency, prompt_tokens=args.prompt_tokens,
+                  completion_tokens=args.completion_tokens, cached_ratio=args.cached_ratio, error_rate=args.llm_error_rate)
+    tmdb = FakeTMDb(args.fixtures, latency=args.tmdb_latency)
+    llm.serve()
+    tmdb.serve()
+    try:
+        db = MemoryDB({'tests': load_tests(), 'genres': [], 'movies': [], 'movies_genres': [], 'result_test': []},
+                      latency=args.db_latency)
+        movies_api = MovieAPI("benchmark", cache_path=None, base_url=tmdb.url)
+        manager = MovieManager(movies_api, db, use_rpc=args.rpc_writes)
+        analyzer = MovieAnalyzer(base_url=llm.url, cache_path=None, max_concurrency=args.max_concurrency,
+                                 prefix_caching=args.prefix_caching, single_step=args.single_step,
+                                 lunary_app_id=None)
+        main = TimedMovieMain(movies_api, manager, analyzer,
+                              log_callback=print if args.verbose else None,
+                              test_concurrency=args.test_concurrency,
+                              movie_concurrency=args.movie_concurrency,
+                              multi_test=args.multi_test)
+
+        start_time = time.perf_counter()
+        movies = []
+        for page in range(args.page, args.page + args.pages):
+            movies += main.analyze_movies(args.year, page, overwrite_movies=False, clear_cache=False)
+        elapsed = time.perf_counter() - start_time
+    finally:
+        llm.shutdown()
+        tmdb.shutdown()
+
+    tests = sum(len(movie['result_test']) for movie in movies)
+    per_movie = max(len(movies), 1)
+    usage = analyzer.get_usage_totals()
+    return {
+        'movies': len(movies),
+        'tests': tests,
+        'seconds': round(elapsed, 3),
+        'movies_per_minute': round(len(movies) / elapsed * 60, 2),
+        'tests_per_minute': round(tests / elapsed * 60, 2),
+        'movie_seconds_p50': round(percentile(main.movie_seconds, 50), 3),
+        'movie_seconds_p95': round(percentile(main.movie_seconds, 95), 3),
+        'db_round_trips_per_movie': round(db.round_trips / per_movie, 2),
+        'db_round_trips': {f"{table}.{operation}": count for (table, operation), count in sorted(db.requests.items())},
+        'llm_requests_per_movie': round(llm.requests / per_movie, 2),
+        'llm_errors': llm.errors,
+        'tmdb_requests': tmdb.requests,
+        'tokens': usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis of movies offline, against a fake LLM, TMDb and database")
+    parser.add_argument("--year", type=int, default=2021, help="Year of the fixture movies to analyze")
+    parser.add_argument("--page", type=int, default=1, help="First fixture page to analyze")
+    parser.add_argument("--pages", type=int, default=1, help="Number of fixture pages to analyze")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="Path of the TMDb fixtures file")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds each LLM request takes")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="Extra seconds per completion token of each LLM request")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of LLM requests failing with a server error")
+    parser.add_argument("--prompt-tokens", type=int, help="Prompt tokens reported per LLM request (default: estimated from the messages)")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="Completion tokens reported per LLM request")
+    parser.add_argument("--cached-ratio", type=float, default=0.0, help="Fraction of the prompt tokens reported as cached")
+    parser.add_argument("--tmdb-latency", type=float, default=0.05, help="Seconds each TMDb request takes")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Seconds each database request takes")
+    parser.add_argument("--test-concurrency", type=int, default=1, help="Number of tests of a movie to run in parallel")
+    parser.add_argument("--movie-concurrency", type=int, default=1, help="Number of movies to analyze in parallel")
+    parser.add_argument("--max-concurrency", type=int, default=50, help="Maximum number of connections to the LLM")
+    parser.add_argument("--prefix-caching", default=False, action="store_true", help="Warm the shared prefix before running tests in parallel")
+    parser.add_argument("--multi-test", default=False, action="store_true", help="Evaluate all the tests of a movie in a single request")
+    parser.add_argument("--single-step", default=False, action="store_true", help="Ask for the final JSON in step 2")
+    parser.add_argument("--rpc-writes", default=False, action="store_true", help="Save results through the Postgres functions")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--verbose", default=False, action="store_true", help="Print the log of the analysis")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(f"Movies analyzed: {report['movies']} ({report['tests']} tests) in {report['seconds']:.1f}s")
+    print(f"Throughput: {report['movies_per_minute']:.1f} movies/min, {report['tests_per_minute']:.1f} tests/min")
+    print(f"Latency per movie: p50 {report['movie_seconds_p50']:.2f}s, p95 {report['movie_seconds_p95']:.2f}s")
+    print(f"DB round-trips per movie: {report['db_round_trips_per_movie']:.1f}")
+    for name, count in report['db_round_trips'].items():
+        print(f"\t{name}: {count}")
+    print(f"LLM requests per movie: {report['llm_requests_per_movie']:.1f} ({report['llm_errors']} errors)")
+    print(f"Tokens: {report['tokens']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,20 @@ import streamlit as st
 
 
 import os
+import subprocess
 import sys
+from typing import Tuple
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
 
+from scripts.core.movie_analyzer import MovieAnalyzer
 from scripts.core.movie_api import MovieAPI
 from scripts.core.movie_manager import MovieManager, Tables
 
 from scripts.helpers.config import Config
+from scripts.helpers.job_queue import JobQueue
+from scripts.helpers.rate_limiter import DEFAULT_QUOTAS, RateLimiter, build_rate_limiters
 from scripts.helpers.supabase_db import SupabaseDB
 import pandas as pd
 
@@ -20,20 +26,55 @@ def main():
     st.write("Symbolic narrative analyzer with AI to detect bias")
 
 
+# Shared by every session and rerun of this process, so clients, pools and caches stay warm
+@st.cache_resource
+def get_config() -> Config:
+    return Config('../scripts/config/config.yaml')
+
+@st.cache_resource
+def get_db() -> SupabaseDB:
+    config = get_config()
+    return SupabaseDB(config.get('supabase_url'), config.get('supabase_key'))
+
+@st.cache_resource
+def get_rate_limiters() -> Tuple[RateLimiter, RateLimiter]:
+    """TMDb and LLM limiters shared by every session, with the quotas in the config."""
+    config = get_config()
+    return build_rate_limiters({key: config.get(key) for key in DEFAULT_QUOTAS})
+
+@st.cache_resource
+def get_api() -> MovieAPI:
+    return MovieAPI(get_config().get('tmdb_api_token'), rate_limiter=get_rate_limiters()[0])
+
+@st.cache_resource
+def get_manager() -> MovieManager:
+    return MovieManager(get_api(), get_db(), fingerprints=get_config().get('fingerprints', False))
+
+@st.cache_resource
+def get_analyzer() -> MovieAnalyzer:
+    return MovieAnalyzer(rate_limiter=get_rate_limiters()[1])
+
+@st.cache_resource
+def get_jobs() -> JobQueue:
+    return JobQueue(os.path.join(ROOT, 'cache', 'jobs.sqlite'))
+
+@st.cache_resource
+def start_job_workers():
+    """Start the worker processes running the submitted jobs, unless `job_workers` is 0 (e.g. to run worker.py apart)."""
+    workers = get_config().get('job_workers', 2)
+    if not workers:
+        return None
+    return subprocess.Popen([sys.executable, 'worker.py', '--workers', str(workers), '--max-running', str(workers)], cwd=ROOT)
+
+
 def init():
-    if 'config' not in st.session_state:
-        st.session_state.config = Config('../scripts/config/config.yaml')
-    if 'db' not in st.session_state:
-        st.session_state.db = SupabaseDB(
-            st.session_state.config.get('supabase_url'), 
-            st.session_state.config.get('supabase_key'))
-    if 'api' not in st.session_state:
-        st.session_state.api = MovieAPI(
-            st.session_state.config.get('tmdb_api_token'))
-    if 'manager' not in st.session_state:
-        st.session_state.manager = MovieManager(
-            st.session_state.api, 
-            st.session_state.db)
+    st.session_state.config = get_config()
+    st.session_state.db = get_db()
+    st.session_state.api = get_api()
+    st.session_state.manager = get_manager()
+    st.session_state.analyzer = get_analyzer()
+    st.session_state.jobs = get_jobs()
+    start_job_workers()
 
 if __name__ == "__main__":
     init()
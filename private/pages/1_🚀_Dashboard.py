@@ -3,104 +3,75 @@ import pandas as pd
 
 from Home import init
 
-from scripts.core.movie_manager import Tables
+from scripts.core.movie_manager import Views
 
 st.title("🚀 Dashboard")
 
-if 'db' not in st.session_state:
+if 'analyzer' not in st.session_state:
     init()
-db = st.session_state.db.client
+db = st.session_state.db
 
-# Getting data
-data_movies = db.table(Tables.MOVIES).select('*', count='exact').execute()
-data_result_tests = db.table(Tables.RESULT_TEST).select('*, tests(name)', count='exact').execute()
-data_genres = db.table(Tables.GENRES).select('*', count='exact').execute()
+# Getting data, aggregated by the views in scripts/sql/views.sql
+@st.cache_data(ttl=300, show_spinner=False)
+def load_view(_db, view: str, key: str) -> pd.DataFrame:
+    return pd.DataFrame(list(_db.iter_rows(str(view), key=key)))
 
-movies_df = pd.DataFrame(data_movies.data)
-result_tests_df = pd.DataFrame(data_result_tests.data)
+if st.button("Refresh data"):
+    load_view.clear()
 
-# Processing data
-result_tests_df = pd.concat([result_tests_df, result_tests_df['tests'].apply(pd.Series)], axis=1)
-result_tests_df = result_tests_df.rename(columns={'name': 'test_name'})
+totals = load_view(db, Views.DASHBOARD_TOTALS, 'total_movies').iloc[0]
+movies_by_year = load_view(db, Views.DASHBOARD_MOVIES_BY_YEAR, 'year')
+results_by_tests = load_view(db, Views.DASHBOARD_RESULTS_BY_TEST, 'test_id')
+movies_with_test_counts = load_view(db, Views.DASHBOARD_MOVIE_TESTS, 'id')
 
 
 # General metrics
 col1, col2, col3 = st.columns(3)
 with col1:
-    st.metric(label="Total Movies", value=data_movies.count)
+    st.metric(label="Total Movies", value=int(totals['total_movies']))
 with col2:
-    st.metric(label="Total Tests", value=data_result_tests.count)
+    st.metric(label="Total Tests", value=int(totals['total_results']))
 with col3:
-    st.metric(label="Total Genres", value=data_genres.count)
+    st.metric(label="Total Genres", value=int(totals['total_genres']))
 
 # Movies by year
-movies_by_year = movies_df.groupby('year').size().reset_index(name='count')
-
 st.subheader("Movies by Year")
-st.bar_chart(movies_by_year.set_index('year'))
+if not movies_by_year.empty:
+    st.bar_chart(movies_by_year.set_index('year'))
 
 
 
 # Results metrics
-result_counts = result_tests_df['result'].value_counts(dropna=False)
-
 st.subheader("Tests Results")
 col1, col2, col3 = st.columns(3)
 with col1:
-    st.metric(label="Passed", value=result_counts.get(True, 0))
+    st.metric(label="Passed", value=int(totals['passed']))
 with col2:
-    st.metric(label="Failed", value=result_counts.get(False, 0))
+    st.metric(label="Failed", value=int(totals['failed']))
 with col3:
-    st.metric(label="Incomplete", value=result_counts.get(None, 0))
+    st.metric(label="Incomplete", value=int(totals['incomplete']))
 
 
 # Results by test
-result_tests_df['result'] = result_tests_df['result'].astype(str)
-results_by_tests = result_tests_df.groupby(['test_name', 'result']).size().unstack(fill_value=0)
-results_by_tests = results_by_tests.rename(columns={
-    'True': 'Passed',
-    'False': 'Failed',
-    'None': 'Incomplete'
-})
-results_by_tests = results_by_tests.reindex(columns=['Passed', 'Failed', 'Incomplete'], fill_value=0)
-results_by_tests = results_by_tests[['Passed', 'Failed', 'Incomplete']]
-
 st.subheader("Results by Test")
-st.bar_chart(results_by_tests)
+if not results_by_tests.empty:
+    results_by_tests = results_by_tests.rename(columns={
+        'passed': 'Passed',
+        'failed': 'Failed',
+        'incomplete': 'Incomplete'
+    })
+    st.bar_chart(results_by_tests.set_index('test_name')[['Passed', 'Failed', 'Incomplete']])
 
 
 # List last movies with count of tests
 st.subheader("Movies")
-tests_count = result_tests_df.groupby('movie_id').size().reset_index(name='test_count')
-movies_with_test_counts = pd.merge(movies_df[['id', 'title', 'created_at']], tests_count, left_on='id', right_on='movie_id', how='left')
-movies_with_test_counts['test_count'] = movies_with_test_counts['test_count'].fillna(0).astype(int)
-movies_with_test_counts['id'] = movies_with_test_counts['id'].astype(str)
-movies_with_test_counts = movies_with_test_counts.sort_values(by='created_at', ascending=False)
-movies_with_test_counts = movies_with_test_counts.rename(columns={
-    'id': 'Movie ID',
-    'title': 'Title',
-    'test_count': 'Tests'
-})
-
-st.dataframe(movies_with_test_counts[['Movie ID', 'Title', 'Tests']], use_container_width=True)
-
-# def make_clickable(val):
-#     return f'<a href="/?movie_id={val}">{val}</a>'
-
-# tests_count = result_tests_df.groupby('movie_id').size().reset_index(name='test_count')
-# movies_with_test_counts = pd.merge(movies_df[['id', 'title', 'created_at']], tests_count, left_on='id', right_on='movie_id', how='left')
-# movies_with_test_counts['test_count'] = movies_with_test_counts['test_count'].fillna(0).astype(int)
-# movies_with_test_counts['id'] = movies_with_test_counts['id'].astype(str)
-# movies_with_test_counts = movies_with_test_counts.sort_values(by='created_at', ascending=False)
-# movies_with_test_counts = movies_with_test_counts.drop(columns=['created_at', 'movie_id'])
-# movies_with_test_counts = movies_with_test_counts.rename(columns={
-#     'id': 'Movie ID',
-#     'title': 'Title',
-#     'test_count': 'Tests'
-# })
-# movies_with_test_counts['Movie ID'] = movies_with_test_counts['Movie ID'].apply(make_clickable)
-
-# st.markdown(
-#     movies_with_test_counts.to_html(escape=False, index=False), 
-#     unsafe_allow_html=True
-# )
+if not movies_with_test_counts.empty:
+    movies_with_test_counts = movies_with_test_counts.sort_values(by='created_at', ascending=False)
+    movies_with_test_counts['id'] = movies_with_test_counts['id'].astype(str)
+    movies_with_test_counts = movies_with_test_counts.rename(columns={
+        'id': 'Movie ID',
+        'title': 'Title',
+        'test_count': 'Tests'
+    })
+
+    st.dataframe(movies_with_test_counts[['Movie ID', 'Title', 'Tests']], use_container_width=True)
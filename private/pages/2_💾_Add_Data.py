@@ -1,32 +1,45 @@
 import streamlit as st
 
-from scripts.core.movie_main import MovieMain
+from Home import init
+
+if 'analyzer' not in st.session_state:
+    init()
 
 st.title("💾 Scan, analyze and save movies")
 
 
 # Add bulk movies ----------------------------------------------------------*
 with st.form("year_page_form"):
-    year = st.number_input("Year", min_value=1900, max_value=2021, step=1, value=2021)
-    page = st.number_input("Page", min_value=1, step=1, value=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        year = st.number_input("Year", min_value=1900, max_value=2021, step=1, value=2021)
+        page = st.number_input("Page", min_value=1, step=1, value=1)
+    with col2:
+        year_end = st.number_input("Year to", min_value=1900, max_value=2021, step=1, value=None, placeholder="Only the first year")
+        page_end = st.number_input("Page to", min_value=1, max_value=500, step=1, value=1)
+    min_votes = st.number_input("Minimum votes", min_value=0, step=10, value=0)
+    movie_concurrency = st.number_input("Movies in parallel", min_value=1, max_value=20, step=1, value=1)
     overwrite_movies = st.checkbox("Overwrite movies", value=False)
+    incremental = st.checkbox("Only re-run changed tests of existing movies", value=False)
     clear_cache = st.checkbox("Clear cache", value=False)
     submit_button = st.form_submit_button("Analyze movies")
 
 if submit_button:
-    with st.status(f"Scanning and analyzing movies for year {year} and page {page}...", expanded=True) as status:
-        
-        movies_api = st.session_state.api 
-        manager = st.session_state.manager
-        config = st.session_state.config
-
-        def progress_callback(message):
-            st.write(message)
-
-        analyzer_main = MovieMain(movies_api, manager, progress_callback)
-        movies = analyzer_main.analyze_movies(year, page, overwrite_movies, clear_cache)
-        
-        status.update(label=f"{len(movies)} movies analyzed and saved!", state="complete", expanded=False)
+    # Ends before the start mean a single year or page
+    year_end = max(year, year_end or year)
+    page_end = max(page, page_end)
+    job_id = st.session_state.jobs.submit('analyze_range', {
+        'year': year,
+        'year_end': year_end,
+        'page': page,
+        'max_pages': page_end - page + 1,
+        'min_votes': min_votes or None,
+        'overwrite': overwrite_movies,
+        'incremental': incremental,
+        'clear_cache': clear_cache,
+        'movie_concurrency': movie_concurrency,
+    })
+    st.success(f"Job #{job_id} submitted to analyze years {year}-{year_end} and pages {page}-{page_end}. Follow it in the Jobs page.")
 
 
 # Add single movie --------------------------------------------------------*
@@ -37,20 +50,7 @@ with st.form("movie_id_form"):
 
 if submit_movie_button:
     if movie_id:
-        with st.status(f"Analyzing movie with ID {movie_id}...", expanded=True) as status:
-            
-            movies_api = st.session_state.api
-            manager = st.session_state.manager
-
-            def progress_callback(message):
-                st.write(message)
-
-            analyzer_main = MovieMain(movies_api, manager, progress_callback)
-            movie = analyzer_main.analyze_single_movie(movie_id, overwrite_movies)
-
-            if movie:
-                status.update(label=f"Movie with ID {movie_id} analyzed and saved!", state="complete", expanded=False)
-            else:
-                status.update(label=f"Not found info in the model!", state="error", expanded=False)
+        job_id = st.session_state.jobs.submit('analyze_movie', {'movie_id': movie_id, 'overwrite': overwrite_movies})
+        st.success(f"Job #{job_id} submitted to analyze movie with ID {movie_id}. Follow it in the Jobs page.")
     else:
-        st.warning("Please enter a valid Movie ID")
\ No newline at end of file
+        st.warning("Please enter a valid Movie ID")
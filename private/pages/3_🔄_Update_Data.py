@@ -1,46 +1,34 @@
+from itertools import islice
+
 import streamlit as st
 
 from Home import init
 
-from scripts.core.movie_analyzer import MovieAnalyzer
 from scripts.core.movie_manager import Tables
 
-if 'db' not in st.session_state:
+if 'analyzer' not in st.session_state:
     init()
-db = st.session_state.db.client
+db = st.session_state.db
 manager = st.session_state.manager 
-analyzer = MovieAnalyzer()
-total_tests = 0
+analyzer = st.session_state.analyzer
 
 st.title("🔄 Update Data")
 
 
+def batched(rows, size):
+    """Group the rows of an iterator in lists of `size`."""
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
 with st.form("update_test_form"):
     st.write("Update the tests' result of movies that have result Incomplete")
     update_tests_btn = st.form_submit_button("Update Incomplete tests")
 
 if update_tests_btn:
-    with st.status(f"Updating tests' results...", expanded=True) as status:
-        
-        # Get all movies and tests with result None
-        st.write("Fetching movies from DB...")
-        data_movies = db.table(Tables.MOVIES).select('*, result_test(*, tests(id, name))').is_('result_test.result', 'null').eq('result_test.active', True).execute()
-
-        for movie in data_movies.data:
-            st.write(f"Analyzing: {movie['title']}({movie['year']}) - {movie['id']}")
-            
-            for test in movie['result_test']:
-                if test['result'] is None:
-                    st.write(f"__ Running test: {test['tests']['name']}")
-
-                    result = manager.create_results(analyzer, movie, test['tests'])
-                    print(result)
-                    result['id'] = test['id']
-                    manager.save_results(result)
-
-                    total_tests += 1
-
-    status.update(label=f"Re-analyzed {total_tests} for {len(data_movies.data)} movies!", state="complete", expanded=True)
+    job_id = st.session_state.jobs.submit('update_incomplete_tests')
+    st.success(f"Job #{job_id} submitted to update the incomplete tests. Follow it in the Jobs page.")
 
 
 
@@ -53,19 +41,20 @@ with st.form("update_translation_form"):
 if update_transtation_btn:
     with st.status(f"Updating reason test to Spanish...", expanded=True) as status:
         
-        # Get all movies and tests with result None
+        # Get all active results without translation
         st.write("Fetching results from DB...")
-        data_results = db.table(Tables.RESULT_TEST).select('*').is_('reason_es', 'null').eq('active', True).execute()
-        st.write(f"{len(data_results.data)} results will be updated.")
+        data_results = db.iter_rows(Tables.RESULT_TEST, {'reason_es': None, 'active': True})
 
+        total_results = 0
+        batch_size = analyzer.translate_batch_size
+        for results in batched(data_results, batch_size):
+            st.write(f"Updating results {total_results + 1}-{total_results + len(results)}")
 
-        for result in data_results.data:
-            st.write(f"Updating movie {result['movie_id']}, result {result['id']}")
-            
-            result['reason_es'] = manager.translate_result(analyzer, result['reason'])
-            manager.save_results(result)
+            manager.translate_results(analyzer, results)
+            manager.save_results_bulk(results)
+            total_results += len(results)
 
-    status.update(label=f"Updated translation of {len(data_results.data)} result!", state="complete", expanded=True)
+    status.update(label=f"Updated translation of {total_results} result!", state="complete", expanded=True)
 
 
 
@@ -79,23 +68,25 @@ with st.form("update_summary_form"):
 if update_summary_btn:
     with st.status(f"Updating summary of movies...", expanded=True) as status:
         
-        # Get all movies with summary None
+        # Get all movies
         st.write("Fetching movies from DB...")
-        #data_movies = db.table(Tables.MOVIES).select('*').is_('summary', 'null').execute()
-        data_movies = db.table(Tables.MOVIES).select('*').execute()
-        st.write(f"{len(data_movies.data)} movies will be updated.")
-        
-        for movie in data_movies.data:
+        data_movies = db.iter_rows(Tables.MOVIES, columns='id, title, year')
+
+        total_movies = 0
+        for movie in data_movies:
             st.write(f"Updating movie {movie['id']}")
 
-            result_test = db.table(Tables.RESULT_TEST).select('*, tests(name, objective)').eq('movie_id', movie['id']).execute()
+            result_test = db.iter_rows(
+                Tables.RESULT_TEST, {'movie_id': movie['id'], 'active': True},
+                columns='id, result, reason, tests(name, objective)')
             movie_isolate = {
                 "id": movie['id'],
                 "title": movie['title'],
                 "year": movie['year'],
-                "result_test": result_test.data
+                "result_test": list(result_test)
             }
             
             manager.create_summary(analyzer, movie_isolate)
+            total_movies += 1
             
-    status.update(label=f"Updated summry of {len(data_movies.data)} movies!", state="complete", expanded=True)
\ No newline at end of file
+    status.update(label=f"Updated summry of {total_movies} movies!", state="complete", expanded=True)
@@ -5,7 +5,7 @@ from Home import init
 
 from scripts.core.movie_manager import Tables
 
-if 'db' not in st.session_state:
+if 'analyzer' not in st.session_state:
     init()
 db = st.session_state.db.client
 base_url_image = 'https://image.tmdb.org/t/p/w500/'
@@ -0,0 +1,55 @@
+import datetime
+
+import pandas as pd
+import streamlit as st
+
+from Home import init
+
+if 'analyzer' not in st.session_state:
+    init()
+jobs = st.session_state.jobs
+
+st.title("📋 Jobs")
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else ""
+
+st.button("Refresh")
+
+# List last jobs
+jobs_list = jobs.list_jobs()
+if not jobs_list:
+    st.info("No jobs yet. Submit one from Add Data or Update Data.")
+    st.stop()
+
+jobs_df = pd.DataFrame([{
+    'Job': job['id'],
+    'Kind': job['kind'],
+    'Status': job['status'],
+    'Created': format_time(job['created_at']),
+    'Finished': format_time(job['finished_at']),
+    'Progress': job['message'] or "",
+} for job in jobs_list])
+st.dataframe(jobs_df, use_container_width=True, hide_index=True)
+
+
+# Job detail
+job_id = st.selectbox("Job", [job['id'] for job in jobs_list], format_func=lambda id: f"#{id}")
+job = jobs.get(job_id)
+
+st.write(f"Status: **{job['status']}**")
+st.write(f"Parameters: {job['params']}")
+if job['result']:
+    st.write(f"Result: {job['result']}")
+if job['error']:
+    st.error(job['error'])
+
+if job['status'] in ('queued', 'running'):
+    if job['cancel_requested']:
+        st.warning("Cancellation requested, the movies being analyzed will be finished first")
+    elif st.button("Cancel job"):
+        jobs.cancel(job_id)
+        st.rerun()
+
+logs = jobs.get_logs(job_id)
+st.code("\n".join(f"{format_time(log['created_at'])} {log['message']}" for log in logs) or "No logs yet")
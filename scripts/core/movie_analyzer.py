@@ -3,26 +3,63 @@ from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, MessagesP
 from langchain.memory import ChatMessageHistory
 from langchain.output_parsers.json import SimpleJsonOutputParser
 from langchain_core.messages import AIMessage
+import hashlib
 import json
+import logging
+import threading
 import cachetools
+import httpx
 
 from lunary import LunaryCallbackHandler
 
+from scripts.helpers.disk_cache import DiskCache
+from scripts.helpers.metrics import metrics
+
 class MovieAnalyzer:
     def __init__(self, 
                 base_url="http://localhost:1234/v1", 
                 api_key="not-needed", 
                 model="gpt-4o-mini",
-                temperature=0):
+                temperature=0,
+                cache_path="./cache/analyzer.sqlite",
+                cache_max_entries=5000,
+                cache_ttl=60 * 60 * 24 * 30,
+                rate_limiter=None,
+                max_concurrency=50,
+                prefix_caching=False,
+                single_step=False,
+                json_mode=False,
+                usage_callback=None,
+                translate_batch_size=20,
+                lunary_app_id="508ded07-b3ab-40c1-b4c4-91b34bac5b98"):
         
-        handler = LunaryCallbackHandler(app_id="508ded07-b3ab-40c1-b4c4-91b34bac5b98")
+        # Tracing is skipped without an app ID, e.g. in the benchmarks
+        callbacks = [LunaryCallbackHandler(app_id=lunary_app_id)] if lunary_app_id else None
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter
+        self.completion_tokens_estimate = 800
+        self.max_concurrency = max_concurrency
+        self.prefix_caching = prefix_caching
+        self.single_step = single_step
+        self.json_mode = json_mode
+        self.usage_callback = usage_callback
+        self.translate_batch_size = translate_batch_size
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "uncached_tokens": 0, "completion_tokens": 0}
+        self.logger = logging.getLogger(__name__)
+
+        # Shared HTTP connection pool for every call to the model
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self.http_client = httpx.Client(limits=limits, timeout=120)
         
         self.chat = ChatOpenAI(
             base_url=base_url, 
             api_key=api_key,
             temperature=temperature,
-            model=model
-            ,callbacks=[handler]
+            model=model,
+            http_client=self.http_client
+            ,callbacks=callbacks
         )
         self.prompts = {
             "system": """
@@ -60,6 +97,16 @@ class MovieAnalyzer:
                     The criteria: {test_criteria}
                     Task: Analyze whether the movie {movie} ({year}) meets these criteria, providing a step-by-step rationale for your conclusion.
             """,
+            "prompt_2_json": """
+                    The criteria: {test_criteria}
+                    Task: Analyze whether the movie {movie} ({year}) meets these criteria, providing a step-by-step rationale for your conclusion.
+                    Answer with a JSON object with the following structure:
+                    - analysis: (your step-by-step rationale)
+                    - result: (boolean)
+                    - reason: (a simple sentence with passed or not this test specific for this movie, be specific). 
+                    - reason_es: (the same reason in Spanish)
+                    Important: Just the json object, nothing else.
+            """,
             "prompt_3": """
                     Based on your analysis, provide a JSON object with the following structure:
                     - result: (boolean)
@@ -67,6 +114,15 @@ class MovieAnalyzer:
                     - reason_es: (the same reason in Spanish)
                     Important: Just the json object, nothing else.
             """,
+            "prompt_many": """
+                    Task: Analyze whether the movie {movie} ({year}) meets each of the following criteria, reasoning briefly about each one separately.
+                    {tests}
+                    Finish your response with an <output> section containing only a JSON object whose keys are the test IDs and whose values have the following structure:
+                    - result: (boolean)
+                    - reason: (a simple sentence with passed or not this test specific for this movie, be specific). 
+                    - reason_es: (the same reason in Spanish)
+                    Include every test ID.
+            """,
             "system_translate": """
                     It acts like a professional translator who always gives a translation regardless of the context.
                     Don't translate the names of the movies.
@@ -75,6 +131,10 @@ class MovieAnalyzer:
                     Give me just a JSON object with key "translated" and  contain the translation to {language} of:
                     "{text}"
             """,
+            "prompt_translate_batch": """
+                    Give me just a JSON object with the same keys as the following JSON object, where each value is the translation to {language} of the original value:
+                    {texts}
+            """,
             "system_summary": """
                     You are a professional content creator and summarizer with a strong radical feminist perspective. You can summarize concisely, ensuring that each word adds value to the summary, aimed at a non-technical audience. 
                     You create short, highly viral content focused on social media.
@@ -117,43 +177,187 @@ class MovieAnalyzer:
         }
 
         self.cache = cachetools.LRUCache(maxsize=100)
+        self.cache_locks = {}
+        self.lock = threading.Lock()
+        self.disk_cache = None
+        self.translation_memory = cachetools.LRUCache(maxsize=1000)
+        if cache_path:
+            self.disk_cache = DiskCache(cache_path, table='knowledge', max_entries=cache_max_entries, ttl=cache_ttl)
+            self.translation_memory = DiskCache(cache_path, table='translations', max_entries=None)
+
+        # The default reason is already translated, so it never needs to reach the model
+        self.set_translation(self.default_empty_object['reason'], 'Spanish', self.default_empty_object['reason_es'])
+
+    def cache_key(self, movie, year):
+        """ Build the cache key for the step 1 response of a movie. """
+        prompt_hash = hashlib.sha256((self.prompts["system"] + self.prompts["prompt_1"]).encode('utf-8')).hexdigest()
+        raw_key = json.dumps([self.model, prompt_hash, movie, str(year)], ensure_ascii=False)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def test_fingerprint(self, test_criteria):
+        """ Fingerprint of the inputs of a test result: model, test criteria and test prompts. """
+        prompts = [self.prompts[name] for name in ("system", "prompt_1", "prompt_2", "prompt_2_json", "prompt_3", "prompt_many")]
+        prompt_hash = hashlib.sha256("".join(prompts).encode('utf-8')).hexdigest()
+        criteria_hash = hashlib.sha256(test_criteria.encode('utf-8')).hexdigest()
+        raw_key = json.dumps([self.model, criteria_hash, prompt_hash])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def summary_fingerprint(self, movie):
+        """ Fingerprint of the inputs of the summary of a movie: model, summary prompts and tests' results. """
+        messages = [self.prompts["system_summary"]] + [message.content for message in self.summary_messages(movie)]
+        raw_key = json.dumps([self.model] + messages, ensure_ascii=False)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
 
     def get_cache(self, movie, year):
-        """ Get the value from the cache. """
-        key = (movie, year)
-        return self.cache.get(key)
+        """ Get the value from the cache, looking in memory first and then on disk. """
+        key = self.cache_key(movie, year)
+        with self.lock:
+            value = self.cache.get(key)
+        if value is None and self.disk_cache is not None:
+            content = self.disk_cache.get(key)
+            if content is not None:
+                value = AIMessage(content=content)
+                with self.lock:
+                    self.cache[key] = value
+        return value
 
     def set_cache(self, movie, year, value):
-        """ Set the value in the cache. """
-        key = (movie, year)
-        self.cache[key] = value
+        """ Set the value in the memory and disk cache. """
+        key = self.cache_key(movie, year)
+        # Keep only the content so every test replays a byte-identical step 1
+        with self.lock:
+            self.cache[key] = AIMessage(content=value.content)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value.content)
 
     def clear_cache(self):
-        """ Clear the cache. """
-        self.cache.clear()
+        """ Clear the memory and disk cache. """
+        with self.lock:
+            self.cache.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+
+    def estimate_tokens(self, chain, messages) -> int:
+        """ Roughly estimate the tokens of a request (prompt + expected completion) for rate limiting. """
+        prompt_messages = chain.first.format_messages(messages=messages)
+        prompt_chars = sum(len(message.content) for message in prompt_messages)
+        return prompt_chars // 4 + self.completion_tokens_estimate
+
+    def get_usage(self, response) -> dict:
+        """ Extract the token usage of a response, splitting cached and uncached input tokens. """
+        usage = response.response_metadata.get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": prompt_tokens - cached_tokens,
+            "completion_tokens": usage.get('completion_tokens') or 0,
+            "total_tokens": usage.get('total_tokens') or 0,
+        }
 
-    def run(self, movie, year, test_criteria):
-        """ Analyzing a movie, utilizing caching and chat history. """
-        chat_history = ChatMessageHistory()
-        json_parser = SimpleJsonOutputParser()
+    def record_usage(self, step, response, estimated_tokens=0):
+        """ Report the token usage of a call and correct the rate limiter reservation with it. """
+        usage = self.get_usage(response)
+        if not usage['total_tokens']:
+            return
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.adjust(usage['total_tokens'] - estimated_tokens)
+
+        with self.lock:
+            self.usage['calls'] += 1
+            for key in ('prompt_tokens', 'cached_tokens', 'uncached_tokens', 'completion_tokens'):
+                self.usage[key] += usage[key]
+        for key in ('cached_tokens', 'uncached_tokens', 'completion_tokens'):
+            metrics.inc('llm_tokens_total', usage[key], step=step, model=self.model, kind=key[:-len('_tokens')])
+
+        self.logger.info(f"{step}: {usage['prompt_tokens']} input tokens ({usage['cached_tokens']} cached, {usage['uncached_tokens']} uncached), {usage['completion_tokens']} output tokens")
+        if self.usage_callback:
+            self.usage_callback(step, usage)
+
+    def get_usage_totals(self) -> dict:
+        """ Get the token usage accumulated by this analyzer. """
+        with self.lock:
+            return dict(self.usage)
+
+    def reserve_rate_limit(self, chain, messages) -> int:
+        """ Wait for the rate limiter, if there is one, and return the tokens reserved. """
+        if self.rate_limiter is None:
+            return 0
+        estimated_tokens = self.estimate_tokens(chain, messages)
+        self.rate_limiter.acquire(estimated_tokens)
+        return estimated_tokens
+
+    def invoke(self, chain, messages, step="chat"):
+        """ Invoke a chain with the chat messages, respecting the rate limiter if there is one. """
+        estimated_tokens = self.reserve_rate_limit(chain, messages)
+        with metrics.timer('llm_request_seconds', step=step, model=self.model):
+            response = chain.invoke({"messages": messages})
+        self.record_usage(step, response, estimated_tokens)
+        return response
+
+    def get_knowledge(self, chain, messages, movie, year):
+        """ Get the step 1 response from the cache or the model, asking the model only once per movie across threads. """
+        response = self.get_cache(movie, year)
+        if response:
+            return response
+
+        key = self.cache_key(movie, year)
+        with self.lock:
+            movie_lock = self.cache_locks.setdefault(key, threading.Lock())
+
+        with movie_lock:
+            response = self.get_cache(movie, year)
+            if not response:
+                response = self.invoke(chain, messages, "step_1")
+                self.set_cache(movie, year, response)
+            # The threads still waiting find the response cached, so the lock is not needed anymore
+            with self.lock:
+                self.cache_locks.pop(key, None)
+        return AIMessage(content=response.content)
+
+    def chain(self, system_prompt, json_output=False):
+        """ Build a chain with the given system prompt followed by the chat messages. """
         prompt_template = ChatPromptTemplate.from_messages([
-            ("system", self.prompts["system"]),
+            ("system", self.prompts[system_prompt]),
             MessagesPlaceholder(variable_name="messages"),
         ])
+        if json_output and self.json_mode:
+            return prompt_template | self.chat.bind(response_format={"type": "json_object"})
+        return prompt_template | self.chat
+
+    def format_prompt(self, prompt, **kwargs):
+        """ Format one of the prompts with the given variables. """
+        return PromptTemplate.from_template(self.prompts[prompt]).format(**kwargs)
+
+    def step_2_prompt(self):
+        """ Name of the step 2 prompt, which asks for the final JSON directly in single step mode. """
+        return "prompt_2_json" if self.single_step else "prompt_2"
+
+    def parse_step_2(self, ai_message: AIMessage) -> dict:
+        """ Parse the final result from a single step response, or None if it is not valid. """
+        result = self.get_json(ai_message)
+        if not self.is_valid_result(result):
+            return None
+        return {key: result[key] for key in ('result', 'reason', 'reason_es') if key in result}
 
-        chain = prompt_template | self.chat
+    def parse_result(self, ai_message: AIMessage) -> dict:
+        """ Parse the JSON result of a test from the step 3 response. """
+        try:
+            return SimpleJsonOutputParser().parse(ai_message.content)
+        except Exception as e:
+            print("Parsing json", e)
+            return self.return_default_empty_object()
 
+    def run(self, movie, year, test_criteria):
+        """ Analyzing a movie, utilizing caching and chat history. """
+        chat_history = ChatMessageHistory()
+        chain = self.chain("system")
         
         # Step 1
-        prompt_1 = PromptTemplate.from_template(self.prompts["prompt_1"])
-        chat_history.add_user_message(prompt_1.format(movie=movie, year=year))
-        
-        response_1 = self.get_cache(movie, year)
-        if not response_1:
-            # Not in cache
-            response_1 = chain.invoke({"messages": chat_history.messages})
-
-            self.set_cache(movie, year, response_1)
+        chat_history.add_user_message(self.format_prompt("prompt_1", movie=movie, year=year))
+        response_1 = self.get_knowledge(chain, chat_history.messages, movie, year)
         chat_history.add_ai_message(response_1)
         
         # The model know the movie?
@@ -161,82 +365,168 @@ class MovieAnalyzer:
             return self.return_default_empty_object()
 
         # Step 2
-        prompt_2 = PromptTemplate.from_template(self.prompts["prompt_2"])
-        chat_history.add_user_message(prompt_2.format(
-            test_criteria=test_criteria,
-            movie=movie, 
-            year=year))
-        response_2 = chain.invoke({"messages": chat_history.messages})
+        chat_history.add_user_message(self.format_prompt(self.step_2_prompt(), test_criteria=test_criteria, movie=movie, year=year))
+        response_2 = self.invoke(self.chain("system", json_output=self.single_step), chat_history.messages, "step_2")
         chat_history.add_ai_message(response_2)
 
+        if self.single_step:
+            result = self.parse_step_2(response_2)
+            if result is not None:
+                return result
+
         # Step 3
-        prompt_3 = PromptTemplate.from_template(self.prompts["prompt_3"])
-        chat_history.add_user_message(prompt_3.format())
-        response_3 = chain.invoke({"messages": chat_history.messages})
+        chat_history.add_user_message(self.format_prompt("prompt_3"))
+        response_3 = self.invoke(chain, chat_history.messages, "step_3")
         chat_history.add_ai_message(response_3)
         
+        return self.parse_result(response_3)
+
+    def run_many(self, movie, year, tests):
+        """ Analyze a movie against several tests in one request, falling back to run() for missing or invalid answers. """
+        chat_history = ChatMessageHistory()
+        chain = self.chain("system")
+
+        # Step 1
+        chat_history.add_user_message(self.format_prompt("prompt_1", movie=movie, year=year))
+        response_1 = self.get_knowledge(chain, chat_history.messages, movie, year)
+        chat_history.add_ai_message(response_1)
+
+        if not self.is_there_information(response_1):
+            return {test['id']: self.return_default_empty_object() for test in tests}
+
+        # Step 2, every test at once
+        chat_history.add_user_message(self.format_prompt("prompt_many", movie=movie, year=year, tests=self.format_tests(tests)))
         try:
-            result = json_parser.parse(response_3.content)
-            return result
+            answers = self.get_json_output(self.invoke(chain, chat_history.messages, "step_many"))
         except Exception as e:
-            print("Parsing json", e)
-            return self.return_default_empty_object()
-    
+            print("Error analyzing tests", e)
+            answers = None
+        if not isinstance(answers, dict):
+            answers = {}
+
+        results = {}
+        for test in tests:
+            result = answers.get(str(test['id']))
+            if self.is_valid_result(result):
+                results[test['id']] = {key: result[key] for key in ('result', 'reason', 'reason_es') if key in result}
+            else:
+                results[test['id']] = self.run(movie, year, test['criteria'])
+        return results
+
+    def format_tests(self, tests):
+        """ Format the criteria of several tests as a list keyed by test ID. """
+        return "\n".join(f"- Test ID {test['id']}: {test['criteria']}" for test in tests)
+
+    def is_valid_result(self, result) -> bool:
+        """ Check that a test result has a boolean result and non empty reasons. """
+        return (isinstance(result, dict)
+                and isinstance(result.get('result'), bool)
+                and isinstance(result.get('reason'), str) and result['reason'].strip() != ""
+                and isinstance(result.get('reason_es', ""), str))
+
+    def translate_messages(self, text, target_language):
+        """ Build the chat messages to translate a text. """
+        chat_history = ChatMessageHistory()
+        chat_history.add_user_message(self.format_prompt("prompt_translate", language=target_language, text=text))
+        return chat_history.messages
+
     def translate(self, text, target_language="en"):
         """ Translates the text to the target language. """
         try:
-            chat_history = ChatMessageHistory()
-            json_parser = SimpleJsonOutputParser()
-            prompt_template = ChatPromptTemplate.from_messages([
-                ("system", self.prompts["system_translate"]),
-                MessagesPlaceholder(variable_name="messages"),
-            ])
-
-            chain_translate = prompt_template | self.chat
-
-            prompt_translate = PromptTemplate.from_template(self.prompts["prompt_translate"])
-            chat_history.add_user_message(prompt_translate.format(language=target_language, text=text))
-            response = chain_translate.invoke({"messages": chat_history.messages})
-            chat_history.add_ai_message(response)
-            
-            result = json_parser.parse(response.content)
-            return result
+            response = self.invoke(self.chain("system_translate"), self.translate_messages(text, target_language), "translate")
+            return SimpleJsonOutputParser().parse(response.content)
         except Exception as e:
             print("Error translating", e)
             return None
-        
 
-    def summary(self, movie):
-        """ Make a summary of the tests' results of a movie. """
+    def translation_key(self, text, target_language):
+        """ Build the translation memory key of a text. """
+        return hashlib.sha256(f"{target_language.lower()}\n{text}".encode('utf-8')).hexdigest()
+
+    def get_translation(self, text, target_language):
+        """ Get a previous translation of the text from the translation memory. """
+        key = self.translation_key(text, target_language)
+        with self.lock:
+            return self.translation_memory.get(key)
+
+    def set_translation(self, text, target_language, translation):
+        """ Save a translation in the translation memory. """
+        key = self.translation_key(text, target_language)
+        with self.lock:
+            if isinstance(self.translation_memory, DiskCache):
+                self.translation_memory.set(key, translation)
+            else:
+                self.translation_memory[key] = translation
+
+    def translate_batch(self, texts, target_language="en"):
+        """ Translates several texts with as few requests as possible, returning the translations aligned with the texts. """
+        translations = [None] * len(texts)
+        pending = {}
+        for index, text in enumerate(texts):
+            if not text:
+                continue
+            translation = self.get_translation(text, target_language)
+            if translation is not None:
+                translations[index] = translation
+            else:
+                pending.setdefault(text, []).append(index)
+
+        pending_texts = list(pending)
+        for start in range(0, len(pending_texts), self.translate_batch_size):
+            chunk = pending_texts[start:start + self.translate_batch_size]
+            for text, translation in zip(chunk, self.translate_chunk(chunk, target_language)):
+                if translation is None:
+                    # Missing from the batch answer, translate it on its own
+                    result = self.translate(text, target_language)
+                    translation = result.get('translated') if isinstance(result, dict) else None
+                if translation is None:
+                    continue
+                self.set_translation(text, target_language, translation)
+                for index in pending[text]:
+                    translations[index] = translation
+        return translations
+
+    def translate_chunk(self, texts, target_language):
+        """ Translates a list of texts in one request, returning None for the ones missing in the answer. """
+        if len(texts) == 1:
+            return [None]
         try:
+            source = json.dumps({str(index): text for index, text in enumerate(texts)}, ensure_ascii=False)
             chat_history = ChatMessageHistory()
-            prompt_template = ChatPromptTemplate.from_messages([
-                ("system", self.prompts["system_summary"]),
-                MessagesPlaceholder(variable_name="messages"),
-            ])
+            chat_history.add_user_message(self.format_prompt("prompt_translate_batch", language=target_language, texts=source))
+            response = self.invoke(self.chain("system_translate", json_output=True), chat_history.messages, "translate")
+            translated = self.get_json(response) or {}
+        except Exception as e:
+            print("Error translating", e)
+            translated = {}
+        return [translated.get(str(index)) if isinstance(translated.get(str(index)), str) else None for index in range(len(texts))]
 
-            chain_summary = prompt_template | self.chat
+    def summary_messages(self, movie):
+        """ Build the chat messages to summarize the tests' results of a movie. """
+        results_str = ""
+        for test in movie['result_test']:
+            results_str += f"{test['tests']['name']} ({test['tests']['objective']}): {'Passed' if test['result'] else 'Failed' if test['result'] is False else 'Incomplete'} \n"
 
-            results_str = ""
-            for test in movie['result_test']:
-                results_str += f"{test['tests']['name']} ({test['tests']['objective']}): {'Passed' if test['result'] else 'Failed' if test['result'] is False else 'Incomplete'} \n"
-            
-            prompt_summary = PromptTemplate.from_template(self.prompts["prompt_summary"])
-            chat_history.add_user_message(prompt_summary.format(movie=movie['title'], year=movie['year'], results=results_str))
-            response = chain_summary.invoke({"messages": chat_history.messages})
-            chat_history.add_ai_message(response)
-
-            obj_summary = self.get_json(response)
-            if obj_summary is None:
-                summary = self.get_output_tags(response)
-            else:
-                summary = obj_summary['summary_in_spanish']
-            
-            return summary
+        chat_history = ChatMessageHistory()
+        chat_history.add_user_message(self.format_prompt("prompt_summary", movie=movie['title'], year=movie['year'], results=results_str))
+        return chat_history.messages
+
+    def parse_summary(self, ai_message: AIMessage):
+        """ Extract the summary from the response, preferring the Spanish JSON version. """
+        obj_summary = self.get_json(ai_message)
+        if obj_summary is None:
+            return self.get_output_tags(ai_message)
+        return obj_summary['summary_in_spanish']
+
+    def summary(self, movie):
+        """ Make a summary of the tests' results of a movie. """
+        try:
+            response = self.invoke(self.chain("system_summary"), self.summary_messages(movie), "summary")
+            return self.parse_summary(response)
         except Exception as e:
             print("Error summating", e)
             return None
-    
+
     def is_there_information(self, ai_message: AIMessage) -> dict:
         """ Extracts the JSON object from the AI message and check if there is information """
         try:
@@ -261,6 +551,15 @@ class MovieAnalyzer:
         except Exception as e:
             return None
 
+    def get_json_output(self, ai_message: AIMessage) -> dict:
+        """ Extracts the JSON object from the <output> section of the AI message, or from the whole message. """
+        start_index = ai_message.content.rfind("<output>")
+        if start_index != -1:
+            obj = self.get_json(AIMessage(content=ai_message.content[start_index:]))
+            if obj is not None:
+                return obj
+        return self.get_json(ai_message)
+
     def get_output_tags(self, ai_message: AIMessage) -> dict:
         """ Extracts text into the tag <output> from the AI message. """
         try:
@@ -1,24 +1,146 @@
+import re
+import threading
+import time
 import requests
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from urllib3.util.retry import Retry
+
+from scripts.helpers.disk_cache import DiskCache
+from scripts.helpers.metrics import metrics
+from scripts.helpers.rate_limiter import RateLimiter
 
 class MovieAPI:
-    def __init__(self, token: str):
-        """Initialize MovieAPI with the given token."""
-        self.base_url = "https://api.themoviedb.org/3/"
+    def __init__(self, token: str, rate_limiter: RateLimiter = None, pool_size: int = 20, retries: int = 5,
+                 backoff_factor: float = 0.5, timeout: tuple = (5, 30), cache_path: str = "./cache/tmdb.sqlite",
+                 cache_ttls: Dict[str, float] = None, base_url: str = "https://api.themoviedb.org/3/"):
+        """Initialize MovieAPI with the given token and an optional shared rate limiter.
+
+        Requests go through a pooled keep-alive session that retries 429/5xx responses with
+        exponential backoff, honoring TMDb's Retry-After header. Responses are cached on disk
+        (unless cache_path is None) for a TTL per endpoint and revalidated with ETag/Last-Modified
+        once stale. `base_url` can point to another TMDb-compatible server, e.g. the benchmark fixtures.
+        """
+        self.base_url = base_url
         self.token = token
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
         self.fields = ['id', 'title', 'release_date', 'poster_path', 'vote_average', 'backdrop_path']
+        # TMDb does not serve discover pages beyond this one
+        self.max_pages = 500
+        self.details = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+        # Seconds a cached response is fresh, by endpoint name ('default' for the rest)
+        self.cache_ttls = {'discover/movie': 60 * 60 * 12, 'movie/{id}': 60 * 60 * 24 * 7, 'default': 60 * 60 * 24}
+        self.cache_ttls.update(cache_ttls or {})
+        self.http_cache = DiskCache(cache_path, table='responses', max_entries=50000) if cache_path else None
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": "Bearer " + token, "Accept": "application/json"})
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def clear_memo(self) -> None:
+        """Forget the movie details fetched so far, so a new run gets fresh data."""
+        with self.lock:
+            self.details.clear()
 
     def make_request(self, endpoint: str) -> Dict[str, str]:
-        """Make a GET request to the given endpoint and return the JSON response."""
-        headers = {"Authorization": "Bearer " + self.token}
-        response = requests.get(self.base_url + endpoint, headers=headers)
+        """Make a GET request to the given endpoint and return the JSON response, using the cache when fresh."""
+        url = self.base_url + endpoint
+        name = self.endpoint_name(endpoint)
+        entry = self.http_cache.get(url) if self.http_cache is not None else None
+        if entry and time.time() - entry['stored_at'] < self.cache_ttls.get(name, self.cache_ttls['default']):
+            self.record_cache(endpoint, 'cache_hits')
+            return entry['body']
+
+        # Stale entry, ask TMDb whether it changed
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        start_time = time.perf_counter()
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        retries = getattr(response.raw, 'retries', None)
+        self.record_request(endpoint, time.perf_counter() - start_time, len(retries.history) if retries else 0)
+
+        if response.status_code == 304 and entry:
+            self.record_cache(endpoint, 'not_modified')
+            entry['stored_at'] = time.time()
+            self.http_cache.set(url, entry)
+            return entry['body']
+
         response.raise_for_status()
-        return response.json()
+        body = response.json()
+        if self.http_cache is not None:
+            self.http_cache.set(url, {
+                'body': body,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'stored_at': time.time(),
+            })
+        return body
+
+    def clear_cache(self) -> None:
+        """Remove every cached TMDb response."""
+        if self.http_cache is not None:
+            self.http_cache.clear()
+
+    def endpoint_name(self, endpoint: str) -> str:
+        """Name of the endpoint without query string and IDs, e.g. movie/{id}."""
+        return re.sub(r'/\d+', '/{id}', '/' + endpoint.split('?')[0]).lstrip('/')
+
+    def endpoint_stats(self, endpoint: str) -> Dict[str, float]:
+        """Get the stats of an endpoint, creating them if needed. Call it holding the lock."""
+        return self.stats.setdefault(self.endpoint_name(endpoint), {
+            'requests': 0, 'retries': 0, 'cache_hits': 0, 'not_modified': 0, 'total_latency': 0.0, 'max_latency': 0.0})
+
+    def record_request(self, endpoint: str, latency: float, retries: int) -> None:
+        """Count the latency and retries of a request by endpoint."""
+        metrics.observe('tmdb_request_seconds', latency, endpoint=self.endpoint_name(endpoint))
+        if retries:
+            metrics.inc('tmdb_retries_total', retries, endpoint=self.endpoint_name(endpoint))
+        with self.lock:
+            stats = self.endpoint_stats(endpoint)
+            stats['requests'] += 1
+            stats['retries'] += retries
+            stats['total_latency'] += latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+
+    def record_cache(self, endpoint: str, outcome: str) -> None:
+        """Count a response served from the cache ('cache_hits') or revalidated ('not_modified')."""
+        metrics.inc('tmdb_cache_total', endpoint=self.endpoint_name(endpoint), outcome=outcome)
+        with self.lock:
+            self.endpoint_stats(endpoint)[outcome] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Get the requests, retries, cache hits and latency (seconds) by endpoint."""
+        with self.lock:
+            return {name: dict(stats, avg_latency=stats['total_latency'] / max(1, stats['requests'])) for name, stats in self.stats.items()}
 
     def fetch_movies(self, lang: str = 'en-US', year: int = 2021, page: int = 1) -> List[Dict[str, str]]:
         """Fetch popular movies and return a list of dictionaries with movie details."""
+        return self.fetch_movies_page(lang, year, page)[0]
+
+    def fetch_movies_page(self, lang: str = 'en-US', year: int = 2021, page: int = 1, min_votes: int = None) -> Tuple[List[Dict[str, str]], int]:
+        """Fetch a page of popular movies of a year, returning the movies and the total number of pages."""
         
-        data = self.make_request(f"discover/movie?include_adult=false&include_video=false&language={lang}&page={page}&sort_by=popularity.desc&primary_release_date.lte={year+1}-01-01&primary_release_date.gte={year}-01-01")
+        data = self.make_request(self.discover_endpoint(lang, year, page, min_votes))
         movies = []
 
         for movie in data['results']:
@@ -27,18 +149,84 @@ class MovieAPI:
                 movie_data['year'] = movie_data['release_date'].split('-')[0]
             movies.append(movie_data)
 
-        return movies
-    
-    def fetch_movie_details(self, movie_id: str, lang: str = 'en-US', raw: bool = True) -> Dict[str, str]:
-        """Fetch the details of a specific movie and return a dictionary with the details."""
-        movie_data = self.make_request(f"movie/{movie_id}?language={lang}")
+        return movies, min(data.get('total_pages', page), self.max_pages)
+
+    def discover_endpoint(self, lang: str, year: int, page: int, min_votes: int = None) -> str:
+        """Endpoint of a page of popular movies of a year."""
+        endpoint = f"discover/movie?include_adult=false&include_video=false&language={lang}&page={page}&sort_by=popularity.desc&primary_release_date.lte={year+1}-01-01&primary_release_date.gte={year}-01-01"
+        if min_votes:
+            endpoint += f"&vote_count.gte={min_votes}"
+        return endpoint
+
+    def iter_movie_pages(self, years: Iterable[int], max_pages: int = None, min_votes: int = None, lang: str = 'en-US', start_page: int = 1) -> Iterator[Tuple[int, int, List[Dict[str, str]]]]:
+        """Yield (year, page, movies) for every page of every year, fetching the next page while the current one is processed."""
+
+        years = list(years)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            year_index, page = 0, start_page
+            future = executor.submit(self.fetch_movies_page, lang, years[0], page, min_votes) if years else None
+            while future is not None:
+                movies, total_pages = future.result()
+                current_year, current_page = years[year_index], page
+
+                last_page = total_pages if max_pages is None else min(total_pages, start_page + max_pages - 1)
+                if page < last_page:
+                    page += 1
+                else:
+                    year_index, page = year_index + 1, start_page
+
+                future = None
+                if year_index < len(years):
+                    future = executor.submit(self.fetch_movies_page, lang, years[year_index], page, min_votes)
+                yield current_year, current_page, movies
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_movies(self, years: Iterable[int], max_pages: int = None, min_votes: int = None, lang: str = 'en-US', start_page: int = 1) -> Iterator[Dict[str, str]]:
+        """Stream the popular movies of several years and pages lazily, without duplicates."""
+
+        seen = set()
+        for _, _, movies in self.iter_movie_pages(years, max_pages, min_votes, lang, start_page):
+            for movie in movies:
+                if movie['id'] in seen:
+                    continue
+                seen.add(movie['id'])
+                yield movie
+
+    def fetch_movie_details(self, movie_id: str, lang: str = 'en-US', raw: bool = True, title_lang: str = None) -> Dict[str, Any]:
+        """Fetch the details of a specific movie, including its external IDs, once per run.
+
+        With raw=False returns the movie fields plus its genres and IMDb ID, ready for MovieManager.save_movie.
+        With title_lang (e.g. es-ES) the translations come in the same request, and the title is the one in that language.
+        """
+        append = "external_ids,translations" if title_lang else "external_ids"
+        key = (str(movie_id), lang, append)
+        with self.lock:
+            movie_data = self.details.get(key)
+        if movie_data is None:
+            movie_data = self.make_request(f"movie/{movie_id}?language={lang}&append_to_response={append}")
+            with self.lock:
+                self.details[key] = movie_data
         if raw:
             return movie_data
         
-        movie_data = {field: movie_data.get(field, None) for field in self.fields}
-        if 'release_date' in movie_data and movie_data['release_date']:
-            movie_data['year'] = movie_data['release_date'].split('-')[0]
-        return movie_data
+        movie = {field: movie_data.get(field, None) for field in self.fields}
+        if 'release_date' in movie and movie['release_date']:
+            movie['year'] = movie['release_date'].split('-')[0]
+        if title_lang:
+            movie['title'] = self.translated_title(movie_data, title_lang) or movie['title']
+        movie['genres'] = movie_data.get('genres', [])
+        movie['imdb_id'] = movie_data.get('imdb_id') or (movie_data.get('external_ids') or {}).get('imdb_id')
+        return movie
+
+    def translated_title(self, movie_data: Dict[str, Any], lang: str) -> str:
+        """Title of a movie in a language (e.g. es-ES) from its appended translations, or None if it has none."""
+        language, _, country = lang.partition('-')
+        for translation in (movie_data.get('translations') or {}).get('translations', []):
+            if translation.get('iso_639_1') == language and (not country or translation.get('iso_3166_1') == country):
+                return (translation.get('data') or {}).get('title') or None
+        return None
 
     def fetch_external_ids(self, movie_id: str) -> Dict[str, str]:
         """Fetch the external IDs of a movie and return a dictionary with the IDs."""
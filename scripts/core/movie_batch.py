@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from langchain.memory import ChatMessageHistory
+from langchain_core.messages import AIMessage
+from openai import OpenAI
+
+from scripts.core.movie_analyzer import MovieAnalyzer
+
+class BatchProvider:
+    """Backend that runs a list of chat completion requests offline."""
+
+    def run(self, requests: List[Dict[str, Any]], name: str) -> Dict[str, str]:
+        """Run the requests and return the content of each response by custom_id."""
+        raise NotImplementedError
+
+
+class OpenAIBatchProvider(BatchProvider):
+    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1/", poll_interval: float = 60,
+                 work_dir: str = "./batches", log: Callable[[str], None] = print):
+        """Batch API provider. Point `base_url` to a local stand-in server to run it without OpenAI."""
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.poll_interval = poll_interval
+        self.work_dir = work_dir
+        self.log = log
+
+    def write_requests(self, requests: List[Dict[str, Any]], name: str) -> str:
+        """Write the requests as a JSONL file in Batch API format."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        path = os.path.join(self.work_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        return path
+
+    def run(self, requests: List[Dict[str, Any]], name: str) -> Dict[str, str]:
+        """Submit the requests, wait for the batch to finish and return the content of each response."""
+        if not requests:
+            return {}
+
+        path = self.write_requests(requests, name)
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h")
+        self.log(f"Batch {batch.id} submitted with {len(requests)} requests ({name})")
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            self.log(f"Batch {batch.id}: {batch.status} ({counts.completed if counts else 0}/{len(requests)})")
+
+        if not batch.output_file_id:
+            self.log(f"Batch {batch.id} finished with status {batch.status} and no output")
+            return {}
+
+        contents = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get('response') or {}
+            if item.get('error') or response.get('status_code') != 200:
+                continue
+            contents[item['custom_id']] = response['body']['choices'][0]['message']['content']
+        return contents
+
+
+class MovieBatch:
+    def __init__(self, analyzer: MovieAnalyzer, provider: BatchProvider, log: Callable[[str], None] = print):
+        """Run the multi-step analysis of many movies through a batch provider, one round per step."""
+        self.analyzer = analyzer
+        self.provider = provider
+        self.log = log
+        self.roles = {'system': 'system', 'human': 'user', 'ai': 'assistant'}
+
+    def build_request(self, custom_id: str, system_prompt: str, messages, json_output: bool = False) -> Dict[str, Any]:
+        """Build a Batch API request line for the chat history with the given system prompt."""
+        prompt_messages = self.analyzer.chain(system_prompt).first.format_messages(messages=messages)
+        body = {
+            "model": self.analyzer.model,
+            "temperature": self.analyzer.chat.temperature,
+            "messages": [{"role": self.roles[message.type], "content": message.content} for message in prompt_messages],
+        }
+        if json_output and self.analyzer.json_mode:
+            body["response_format"] = {"type": "json_object"}
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+    def run(self, movies: List[Dict[str, Any]], tests: List[Dict[str, Any]]) -> Dict[Any, Dict[Any, Dict[str, Any]]]:
+        """Analyze the movies with every test.
+
+        Returns the results by movie ID and test ID. Movies unknown to the model map to None, movies
+        whose step 1 request failed are missing and so are the tests whose requests failed.
+        """
+        analyzer = self.analyzer
+        movies = {str(movie['id']): movie for movie in movies}
+
+        # Step 1, only for the movies not in the cache
+        histories = {}
+        requests = []
+        for movie_id, movie in movies.items():
+            history = ChatMessageHistory()
+            history.add_user_message(analyzer.format_prompt("prompt_1", movie=movie['title'], year=movie['year']))
+            histories[movie_id] = history
+            if not analyzer.get_cache(movie['title'], movie['year']):
+                requests.append(self.build_request(movie_id, "system", history.messages))
+        self.log(f"Step 1: {len(requests)} requests ({len(movies) - len(requests)} cached)")
+        for movie_id, content in self.provider.run(requests, "step_1").items():
+            movie = movies[movie_id]
+            analyzer.set_cache(movie['title'], movie['year'], AIMessage(content=content))
+
+        results = {}
+        for movie_id, movie in movies.items():
+            response_1 = analyzer.get_cache(movie['title'], movie['year'])
+            if response_1 is None:
+                # The request failed, which says nothing about the model knowing the movie
+                continue
+            if not analyzer.is_there_information(response_1):
+                results[movie['id']] = None
+                continue
+            histories[movie_id].add_ai_message(response_1)
+            results[movie['id']] = {}
+
+        # Step 2
+        test_histories = {}
+        requests = []
+        for movie_id, movie in movies.items():
+            if results.get(movie['id']) is None:
+                continue
+            for test in tests:
+                custom_id = f"{movie_id}:{test['id']}"
+                history = ChatMessageHistory(messages=list(histories[movie_id].messages))
+                history.add_user_message(analyzer.format_prompt(analyzer.step_2_prompt(), test_criteria=test['criteria'], movie=movie['title'], year=movie['year']))
+                test_histories[custom_id] = (movie, test, history)
+                requests.append(self.build_request(custom_id, "system", history.messages, json_output=analyzer.single_step))
+        self.log(f"Step 2: {len(requests)} requests")
+        responses_2 = self.provider.run(requests, "step_2")
+
+        # Step 3, only for the tests without a valid result yet
+        requests = []
+        for custom_id, content in responses_2.items():
+            movie, test, history = test_histories[custom_id]
+            response_2 = AIMessage(content=content)
+            if analyzer.single_step:
+                result = analyzer.parse_step_2(response_2)
+                if result is not None:
+                    results[movie['id']][test['id']] = result
+                    continue
+            history.add_ai_message(response_2)
+            history.add_user_message(analyzer.format_prompt("prompt_3"))
+            requests.append(self.build_request(custom_id, "system", history.messages))
+        self.log(f"Step 3: {len(requests)} requests")
+        for custom_id, content in self.provider.run(requests, "step_3").items():
+            movie, test, _ = test_histories[custom_id]
+            results[movie['id']][test['id']] = analyzer.parse_result(AIMessage(content=content))
+
+        return results
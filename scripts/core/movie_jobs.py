@@ -0,0 +1,96 @@
+import threading
+import time
+import traceback
+from typing import Any, Dict
+
+from scripts.core.movie_analyzer import MovieAnalyzer
+from scripts.core.movie_api import MovieAPI
+from scripts.core.movie_main import MovieMain
+from scripts.core.movie_manager import MovieManager
+from scripts.helpers.config import Config
+from scripts.helpers.job_queue import JobQueue
+from scripts.helpers.rate_limiter import DEFAULT_QUOTAS, build_rate_limiters
+from scripts.helpers.supabase_db import SupabaseDB
+
+class MovieJobs:
+    def __init__(self, queue: JobQueue, config_path: str = './scripts/config/config.yaml', max_running: int = 2,
+                 poll_interval: float = 2, heartbeat_timeout: float = 60):
+        """Worker running the jobs of the queue in this process, one at a time.
+
+        At most `max_running` jobs run at once across every worker sharing the queue.
+        """
+        self.queue = queue
+        self.config_path = config_path
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.handlers = {
+            'analyze_range': self.analyze_range,
+            'analyze_movie': self.analyze_movie,
+            'update_incomplete_tests': self.update_incomplete_tests,
+        }
+        self.api = None
+
+    def init(self):
+        """Build the clients once per worker, so their pools and caches are reused by every job."""
+        if self.api is not None:
+            return
+        config = Config(self.config_path)
+        db = SupabaseDB(config.get('supabase_url'), config.get('supabase_key'))
+        # Up to max_running jobs call the APIs at once, each from its own worker, so each gets its share of the quotas
+        tmdb_rate_limiter, llm_rate_limiter = build_rate_limiters({key: config.get(key) for key in DEFAULT_QUOTAS}, share=self.max_running)
+        self.api = MovieAPI(config.get('tmdb_api_token'), rate_limiter=tmdb_rate_limiter)
+        self.manager = MovieManager(self.api, db, fingerprints=config.get('fingerprints', False))
+        self.analyzer = MovieAnalyzer(rate_limiter=llm_rate_limiter)
+
+    def run_forever(self):
+        """Take and run queued jobs until the process is stopped."""
+        while True:
+            self.queue.recover(self.heartbeat_timeout)
+            job = self.queue.claim(self.max_running)
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: Dict[str, Any]):
+        """Run a claimed job, sending heartbeats and watching for cancellation meanwhile."""
+        cancel_event = threading.Event()
+        done = threading.Event()
+
+        def watch():
+            while not done.wait(self.poll_interval):
+                if self.queue.heartbeat(job['id']):
+                    cancel_event.set()
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            self.init()
+            main = MovieMain(self.api, self.manager, self.analyzer,
+                             log_callback=lambda message: self.queue.log(job['id'], message),
+                             test_concurrency=job['params'].get('test_concurrency', 1),
+                             movie_concurrency=job['params'].get('movie_concurrency', 1),
+                             incremental=job['params'].get('incremental', False),
+                             cancel_event=cancel_event)
+            result = self.handlers[job['kind']](main, job['params'])
+            self.queue.finish(job['id'], 'cancelled' if cancel_event.is_set() else 'done', result)
+        except Exception as e:
+            self.queue.log(job['id'], traceback.format_exc())
+            self.queue.finish(job['id'], 'failed', error=str(e))
+        finally:
+            done.set()
+            watcher.join()
+
+    def analyze_range(self, main: MovieMain, params: Dict[str, Any]) -> Dict[str, Any]:
+        years = range(params['year'], params.get('year_end', params['year']) + 1)
+        movies = main.analyze_movie_range(years, params.get('page', 1), params.get('max_pages'), params.get('min_votes'),
+                                          params.get('overwrite', False), params.get('clear_cache', False))
+        return {'movies': len(movies)}
+
+    def analyze_movie(self, main: MovieMain, params: Dict[str, Any]) -> Dict[str, Any]:
+        movie = main.analyze_single_movie(params['movie_id'], params.get('overwrite', False))
+        return {'movies': 1 if movie else 0}
+
+    def update_incomplete_tests(self, main: MovieMain, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {'tests': main.update_incomplete_tests()}
@@ -1,47 +1,301 @@
 import datetime
-from typing import List, Dict, Any
+import queue
+import threading
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, List
 
 from scripts.core.movie_analyzer import MovieAnalyzer
 from scripts.core.movie_api import MovieAPI
+from scripts.core.movie_batch import MovieBatch
 from scripts.core.movie_manager import MovieManager
+from scripts.helpers.checkpoint import Checkpoint
 from scripts.helpers.logger import Logger
+from scripts.helpers.metrics import metrics
 
 class MovieMain:
-    def __init__(self, movies_api: MovieAPI, manager: MovieManager, analyzer: MovieAnalyzer = None, log_callback = None):
+    def __init__(self, movies_api: MovieAPI, manager: MovieManager, analyzer: MovieAnalyzer = None, log_callback = None, test_concurrency: int = 1, movie_concurrency: int = 1, multi_test: bool = False, cancel_event: threading.Event = None, incremental: bool = False, checkpoint: Checkpoint = None):
         self.movies_api = movies_api
         self.manager = manager
         self.analyzer = MovieAnalyzer() if analyzer is None else analyzer
         self.logger = Logger().get_logger()
         self.log_callback = log_callback
         self.lang = 'es-ES'
+        self.test_concurrency = max(1, test_concurrency)
+        self.movie_concurrency = max(1, movie_concurrency)
+        self.multi_test = multi_test
+        self.incremental = incremental
+        self.checkpoint = checkpoint
+        self.known_movies = {}
+        self.metrics_start = metrics.snapshot()
+        self.log_queue = queue.Queue()
+        self.log_thread = threading.get_ident()
+        self.cancel_event = threading.Event() if cancel_event is None else cancel_event
+        if incremental and not manager.fingerprints:
+            self.log("Fingerprints are not saved, so incremental runs cannot tell which results are up to date (set fingerprints: True in the config)")
+
+    def cancel(self):
+        """Stop taking new movies; the ones being analyzed are finished and saved."""
+        self.cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
 
     def analyze_movies(self, year: int, page: int, overwrite_movies: bool, clear_cache: bool) -> List[Dict[str, Any]]:
         """Get movies from the API, analyze them and save the results."""
         
+        self.log_thread = threading.get_ident()
         self.log_start()
         
+        self.movies_api.clear_memo()
+        if clear_cache:
+            self.movies_api.clear_cache()
         movies = self.fetch_movies(year, page)
+        return self.analyze(movies, overwrite_movies, clear_cache)
+
+    def analyze_movie_range(self, years: Iterable[int], start_page: int, max_pages: int, min_votes: int, overwrite_movies: bool, clear_cache: bool) -> List[Dict[str, Any]]:
+        """Stream the movies of several years and pages from the API, analyze them and save the results."""
+
+        self.log_thread = threading.get_ident()
+        self.log_start()
+
+        self.movies_api.clear_memo()
+        if clear_cache:
+            self.movies_api.clear_cache()
+        self.log("Streaming movies from API...")
+        if self.checkpoint is not None:
+            pages = self.movies_api.iter_movie_pages(years, max_pages=max_pages, min_votes=min_votes, lang=self.lang, start_page=start_page)
+            return self.analyze_pages(pages, overwrite_movies, clear_cache)
+        movies = self.movies_api.iter_movies(years, max_pages=max_pages, min_votes=min_votes, lang=self.lang, start_page=start_page)
+        return self.analyze(movies, overwrite_movies, clear_cache)
+
+    def analyze(self, movies: Iterable[Dict[str, Any]], overwrite_movies: bool, clear_cache: bool) -> List[Dict[str, Any]]:
+        """Analyze the movies and save the results."""
+
         tests_list = self.manager.get_tests()
         
+        if clear_cache:
+            self.analyzer.clear_cache()
+            self.log("Cache cleared")
+
+        # Results queued before an error or interruption are saved too
+        try:
+            analyzed_movies = self.process_movies(movies, overwrite_movies, tests_list)
+        finally:
+            self.flush_results()
+        return self.log_end(analyzed_movies)
+
+    def analyze_pages(self, pages: Iterable[Any], overwrite_movies: bool, clear_cache: bool) -> List[Dict[str, Any]]:
+        """Analyze the movies page by page, recording in the checkpoint journal the pages whose movies are all saved."""
+
+        tests_list = self.manager.get_tests()
+
         if clear_cache:
             self.analyzer.clear_cache()
             self.log("Cache cleared")
 
         analyzed_movies = []
-        for movie in movies:
-            analyzed_movie = self.process_movie(movie, overwrite_movies, tests_list)
-            if analyzed_movie:
-                analyzed_movies.append(analyzed_movie)
+        seen = set()
+        # Results queued before an error or interruption are saved too
+        try:
+            for year, page, movies in pages:
+                if self.is_cancelled():
+                    break
+                if self.checkpoint.is_page_done(year, page):
+                    self.log(f"Page {page} of {year} was done in a previous run, so it was skipped")
+                    continue
+
+                movies = [movie for movie in movies if movie['id'] not in seen]
+                seen.update(movie['id'] for movie in movies)
+                analyzed_movies += self.process_movies(movies, overwrite_movies, tests_list)
+
+                self.flush_results()
+                if all(self.checkpoint.movie_status(movie['id']) == 'done' for movie in movies):
+                    self.checkpoint.set_page_done(year, page)
+        finally:
+            self.flush_results()
+
+        return self.log_end(analyzed_movies)
+
+    def process_movies(self, movies: Iterable[Dict[str, Any]], overwrite_movies: bool, tests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Process the movies one by one or concurrently, returning the analyzed ones."""
+
+        movies = self.prefilter_movies(movies, overwrite_movies, tests_list)
+        try:
+            if self.movie_concurrency > 1:
+                return self.process_movies_concurrently(movies, overwrite_movies, tests_list)
+
+            analyzed_movies = []
+            for movie in movies:
+                if self.is_cancelled():
+                    break
+                analyzed_movie = self.process_movie(movie, overwrite_movies, tests_list)
+                if analyzed_movie:
+                    analyzed_movies.append(analyzed_movie)
+            return analyzed_movies
+        finally:
+            self.known_movies.clear()
+
+    def prefilter_movies(self, movies: Iterable[Dict[str, Any]], overwrite_movies: bool, tests_list: List[Dict[str, Any]], chunk_size: int = 20):
+        """Look up the movies in the database in chunks, one query each, skipping the ones already analyzed.
+
+        Movies saved without an active result for every test go on, to run only the missing tests.
+        """
+
+        movies = iter(movies)
+        while chunk := list(islice(movies, chunk_size)):
+            existing_movies = self.manager.get_existing_movies([movie['id'] for movie in chunk])
+            for movie in chunk:
+                existing_movie = existing_movies.get(movie['id'])
+                if existing_movie is not None:
+                    existing_movie['complete'] = self.is_complete(existing_movie, tests_list)
+                    if existing_movie['complete'] and not overwrite_movies and not self.incremental:
+                        self.log(f"{movie['title']}({movie['year']}) - {movie['id']} already exists in the database, so it was skipped")
+                        if self.checkpoint is not None:
+                            self.checkpoint.set_movie_status(movie['id'], 'done')
+                        continue
+                self.known_movies[movie['id']] = existing_movie
+                yield movie
+
+    def is_complete(self, existing_movie: Dict[str, Any], tests_list: List[Dict[str, Any]]) -> bool:
+        """Whether a saved movie has an active result for every test."""
 
+        test_ids = {result['test_id'] for result in existing_movie.get('result_test') or []}
+        return all(test['id'] in test_ids for test in tests_list)
+
+    def log_end(self, analyzed_movies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Log the end of an analysis with its usage and stats."""
+
+        if self.is_cancelled():
+            self.log("Analysis cancelled")
         self.log(f"{len(analyzed_movies)} movies analyzed and saved!")
+        self.log_usage()
+        self.log_api_stats()
+        self.log_metrics()
         return analyzed_movies
 
 
+    def analyze_movies_batch(self, year: int, page: int, overwrite_movies: bool, batch: MovieBatch) -> List[Dict[str, Any]]:
+        """Get movies from the API, analyze them offline with the batch API and save the results."""
+
+        self.log_thread = threading.get_ident()
+        self.log_start()
+
+        self.movies_api.clear_memo()
+        movies = self.fetch_movies(year, page)
+        tests_list = self.manager.get_tests()
+
+        existing_movies = self.manager.get_existing_movies([movie['id'] for movie in movies])
+        pending_movies = []
+        for movie in movies:
+            existing_movie = existing_movies.get(movie['id'])
+            # A batch runs every test of its movies, so incomplete movies are left to the regular runs
+            if not overwrite_movies and existing_movie is not None:
+                self.log(f"{movie['title']}({movie['year']}) - {movie['id']} already exists in the database, so it was skipped")
+                continue
+            pending_movies.append(movie)
+
+        self.log(f"Analyzing {len(pending_movies)} movies with the batch API...")
+        batch_results = batch.run(pending_movies, tests_list)
+
+        # Keep only the movies the model knows, with their results
+        analyzed_movies = []
+        results_by_movie = {}
+        for movie in pending_movies:
+            self.log(f"Collecting: {movie['title']}({movie['year']}) - {movie['id']}")
+            if movie['id'] not in batch_results:
+                self.log(f"\tError running step 1: batch request failed, so it was skipped")
+                continue
+            movie_results = batch_results[movie['id']]
+
+            # Tests whose batch requests failed are missing, as if they had raised an error
+            tests_done = [test for test in tests_list if movie_results is not None and test['id'] in movie_results]
+            for current_test in tests_list:
+                if movie_results is not None and current_test['id'] not in movie_results:
+                    self.log(f"\tError running test: {current_test['name']}. Error: batch request failed")
+
+            if movie_results is not None and not tests_done:
+                self.log(f"\tEvery batch request failed, so it was skipped")
+                continue
+
+            results = [self.manager.prepare_result(movie, test, movie_results[test['id']], 0, self.analyzer.test_fingerprint(test['criteria']))
+                       for test in tests_done]
+            if movie_results is None or any(result['result'] is None for result in results):
+                # Delete movie because there is no info in the model
+                self.manager.delete_movie(movie['id'])
+                self.log(f"\tNo info in the model, so it was skipped")
+                continue
+
+            for current_test, result in zip(tests_done, results):
+                result['tests'] = current_test
+            results_by_movie[movie['id']] = results
+            analyzed_movies.append(movie)
+
+        # Save every movie and result at once
+        all_results = [result for results in results_by_movie.values() for result in results]
+        self.manager.translate_results(self.analyzer, [result for result in all_results if 'reason_es' not in result])
+        if analyzed_movies:
+            self.log(f"Saving {len(analyzed_movies)} movies and {len(all_results)} results")
+            self.manager.save_movies(analyzed_movies)
+            if not self.manager.use_rpc:
+                for movie in analyzed_movies:
+                    self.manager.set_tests_inactive(movie['id'])
+                self.manager.save_results_bulk(all_results)
+
+        for movie in analyzed_movies:
+            movie['result_test'] = results_by_movie[movie['id']]
+            self.log(f"Generating summary: {movie['title']}({movie['year']}) - {movie['id']}")
+            if self.manager.use_rpc:
+                self.manager.replace_movie_results(self.analyzer, movie)
+            else:
+                self.manager.create_summary(self.analyzer, movie)
+
+        return self.log_end(analyzed_movies)
+
     def analyze_single_movie(self, movie_id: str, overwrite_movies: bool) -> Dict[str, Any]:
         """Get a single movie from the API, analyze it and save the results."""
         
-        movie = self.movies_api.fetch_movie_details(movie_id, lang=self.lang, raw=False)
-        return self.process_movie(movie, overwrite_movies, self.manager.get_tests())
+        self.log_thread = threading.get_ident()
+        self.movies_api.clear_memo()
+        # Genres are saved with their en-US names, so fetch the movie in en-US with its title in self.lang
+        movie = self.movies_api.fetch_movie_details(movie_id, raw=False, title_lang=self.lang)
+        try:
+            return self.process_movie(movie, overwrite_movies, self.manager.get_tests())
+        finally:
+            self.flush_results()
+
+
+    def update_incomplete_tests(self) -> int:
+        """Re-run the active tests without result and save them, returning how many were run."""
+
+        self.log_thread = threading.get_ident()
+        self.log_start()
+
+        movie_ids = set()
+        total_tests = 0
+        for test in self.manager.iter_incomplete_results():
+            if self.is_cancelled():
+                self.log("Update cancelled")
+                break
+
+            movie = test['movies']
+            if movie['id'] not in movie_ids:
+                self.log(f"Analyzing: {movie['title']}({movie['year']}) - {movie['id']}")
+                movie_ids.add(movie['id'])
+
+            self.log(f"\tRunning test: {test['tests']['name']}")
+            try:
+                result = self.manager.create_results(self.analyzer, movie, test['tests'])
+                result['id'] = test['id']
+                self.manager.save_results(result)
+                total_tests += 1
+            except Exception as e:
+                self.log(f"\tError running test: {test['tests']['name']}. Error: {e}")
+
+        self.log(f"Re-analyzed {total_tests} tests for {len(movie_ids)} movies!")
+        self.log_usage()
+        self.log_metrics()
+        return total_tests
 
 
     def fetch_movies(self, year: int, page: int) -> List[Dict[str, Any]]:
@@ -51,67 +305,313 @@ class MovieMain:
         return self.movies_api.fetch_movies(year=year, page=page, lang=self.lang)
 
 
+    def process_movies_concurrently(self, movies: Iterable[Dict[str, Any]], overwrite_movies: bool, tests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Process several movies at once with a pool of workers, taking new movies as workers get free."""
+
+        analyzed_movies = []
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=self.movie_concurrency)
+        try:
+            for movie in movies:
+                if self.is_cancelled():
+                    break
+                futures[executor.submit(self.process_movie, movie, overwrite_movies, tests_list)] = movie
+                while len(futures) >= self.movie_concurrency:
+                    self.wait_movies(futures, analyzed_movies)
+            while futures:
+                self.wait_movies(futures, analyzed_movies)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return analyzed_movies
+
+    def wait_movies(self, futures: Dict[Any, Dict[str, Any]], analyzed_movies: List[Dict[str, Any]]):
+        """Wait a little for the movies being processed, collecting the ones that finish."""
+
+        done, _ = wait(futures, timeout=0.2, return_when=FIRST_COMPLETED)
+        self.flush_log()
+        for future in done:
+            movie = futures.pop(future)
+            try:
+                analyzed_movie = future.result()
+            except Exception as e:
+                self.log(f"Error analyzing: {movie['title']}. Error: {e}")
+                continue
+            if analyzed_movie:
+                analyzed_movies.append(analyzed_movie)
+
     def process_movie(self, movie: Dict[str, Any], overwrite_movies: bool, tests_list: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Process a movie by analyzing it and saving the results."""
+        """Process a movie by analyzing it and saving the results, recording its progress in the checkpoint journal."""
+
+        if self.checkpoint is None:
+            return self.analyze_movie(movie, overwrite_movies, tests_list)
+
+        status = self.checkpoint.movie_status(movie['id'])
+        if status == 'done':
+            self.log(f"{movie['title']}({movie['year']}) - {movie['id']} was done in a previous run, so it was skipped")
+            return None
+
+        self.checkpoint.set_movie_status(movie['id'], 'started')
+        analyzed_movie = self.analyze_movie(movie, overwrite_movies, tests_list, resuming=status is not None)
+        self.checkpoint.set_movie_status(movie['id'], 'processed')
+        return analyzed_movie
+
+    def analyze_movie(self, movie: Dict[str, Any], overwrite_movies: bool, tests_list: List[Dict[str, Any]], resuming: bool = False) -> Dict[str, Any]:
+        """Analyze a movie and save the results. When resuming, the results in the checkpoint journal are reused."""
 
         self.log(f"Analyzing: {movie['title']}({movie['year']}) - {movie['id']}")
         
-        existing_movie = self.manager.get_movie(movie['id'])
-        if not overwrite_movies and existing_movie:
+        if movie['id'] in self.known_movies:
+            existing_movie = self.known_movies.pop(movie['id'])
+        else:
+            existing_movie = self.manager.get_movie(movie['id'])
+        complete = existing_movie is not None and existing_movie.get('complete', True)
+        if not overwrite_movies and not self.incremental and not resuming and complete:
             self.log(f'\tAlready exists in the database, so it was skipped')
             return None
         
         if overwrite_movies or not existing_movie:
             movie = self.manager.save_movie(movie)
 
-        self.manager.set_tests_inactive(movie['id'])
+        # In incremental mode, keep the results whose inputs did not change and run only the rest
+        all_tests = tests_list
+        reused_results = []
+        if existing_movie and not complete and not overwrite_movies and not self.incremental:
+            # Saved without some results, e.g. by an interrupted run or after adding a test: run only the missing ones
+            reused_results, tests_list = self.split_stale_tests(movie, tests_list, missing_only=True)
+        elif self.incremental and existing_movie:
+            reused_results, tests_list = self.split_stale_tests(movie, tests_list)
+            if not tests_list:
+                movie['result_test'] = reused_results
+                if self.manager.reusable_summary(self.analyzer, movie, existing_movie):
+                    self.log(f"\tUp to date, so it was skipped")
+                    return None
+                self.log(f"\tGenerating summary")
+                self.manager.create_summary(self.analyzer, movie)
+                return movie
+
+        # Results of this run recorded before it was interrupted
+        journal_results = []
+        if resuming:
+            recorded = self.checkpoint.get_results(movie['id'])
+            journal_results = [dict(recorded[test['id']], tests=test) for test in tests_list if test['id'] in recorded]
+            if journal_results:
+                self.log(f"\t{len(journal_results)} tests recovered from the previous run")
+        pending_tests = [test for test in tests_list if test['id'] not in {result['test_id'] for result in journal_results}]
+
+        # With RPC writes the previous results stay active until they are replaced in one transaction
+        if not self.manager.use_rpc:
+            self.manager.set_tests_inactive(movie['id'], [test['id'] for test in tests_list] if reused_results else None)
         
-        results_test = self.run_tests(movie, tests_list)
+        results_test = self.run_tests(movie, pending_tests) if pending_tests else []
         if results_test is None:
             self.log(f"\tNo info in the model, so it was skipped")
             return None
+        results_test = journal_results + results_test
+
+        tests_order = {test['id']: index for index, test in enumerate(all_tests)}
+        movie['result_test'] = sorted(reused_results + results_test, key=lambda result: tests_order[result['test_id']])
+        # The saved summary is kept when the tests run again gave the same results
+        summary = None if overwrite_movies else self.manager.reusable_summary(self.analyzer, movie, existing_movie)
+        if self.manager.use_rpc:
+            self.log(f"\tSaving results" if summary else f"\tGenerating summary and saving results")
+            self.manager.replace_movie_results(self.analyzer, movie, summary)
+            return movie
+
+        self.manager.queue_results(results_test)
         
-        movie['result_test'] = results_test
-        
-        self.log(f"\tGenerating summary")
-        self.manager.create_summary(self.analyzer, movie)
+        if summary:
+            self.log(f"\tSummary up to date")
+        else:
+            self.log(f"\tGenerating summary")
+            self.manager.create_summary(self.analyzer, movie)
         
         return movie
 
+    def split_stale_tests(self, movie: Dict[str, Any], tests_list: List[Dict[str, Any]], missing_only: bool = False):
+        """Split the tests of a movie into its active results still up to date and the tests to run again.
+
+        With missing_only, every active result is kept whatever its fingerprint, and only the tests without one run.
+        """
+
+        active_results = {result['test_id']: result for result in self.manager.get_active_results(movie['id'])}
+        reused_results = []
+        stale_tests = []
+        for test in tests_list:
+            result = active_results.get(test['id'])
+            if result is not None and (missing_only or result.get('fingerprint') == self.analyzer.test_fingerprint(test['criteria'])):
+                reused_results.append(result)
+            else:
+                stale_tests.append(test)
+
+        self.log(f"\t{len(stale_tests)} tests to run, {len(reused_results)} up to date")
+        return reused_results, stale_tests
+
     def run_tests(self, movie: Dict[str, Any], tests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Run the tests for a movie."""
 
+        if self.multi_test:
+            return self.run_tests_together(movie, tests_list)
+
+        sequential_tests, concurrent_tests = tests_list, []
+        if self.test_concurrency > 1:
+            # With prefix caching the first test runs alone, so the provider caches the shared prefix before the fan-out
+            warm_up = 1 if getattr(self.analyzer, 'prefix_caching', False) else 0
+            sequential_tests, concurrent_tests = tests_list[:warm_up], tests_list[warm_up:]
+
         results_test = []
-        for current_test in tests_list:
+        for current_test in sequential_tests:
             try:
                 self.log(f"\tRunning test: {current_test['name']}")
                 result = self.manager.create_results(self.analyzer, movie, current_test)
 
-                # Check if there is info
-                if result['result'] is None:
-                    # Delete movie because there is info in the model
-                    self.manager.delete_movie(movie['id'])
+                if not self.collect_result(movie, current_test, result, results_test):
                     return None
-
-                self.manager.save_results(result)
-                
-                result['tests'] = current_test
-                results_test.append(result)
             except Exception as e:
                 self.log(f"\tError running test: {current_test['name']}. Error: {e}")
+
+        if concurrent_tests and not self.run_tests_concurrently(movie, concurrent_tests, results_test):
+            return None
+
+        order = {test['id']: index for index, test in enumerate(tests_list)}
+        results_test.sort(key=lambda result: order[result['test_id']])
+        return results_test
+
+    def run_tests_concurrently(self, movie: Dict[str, Any], tests_list: List[Dict[str, Any]], results_test: List[Dict[str, Any]]) -> bool:
+        """Run the tests for a movie in parallel, cancelling the rest as soon as one has no info."""
+
+        executor = ThreadPoolExecutor(max_workers=self.test_concurrency)
+        try:
+            futures = {}
+            for current_test in tests_list:
+                self.log(f"\tRunning test: {current_test['name']}")
+                futures[executor.submit(self.manager.create_results, self.analyzer, movie, current_test)] = current_test
+
+            for future in self.as_completed(futures):
+                current_test = futures[future]
+                try:
+                    if not self.collect_result(movie, current_test, future.result(), results_test):
+                        return False
+                except Exception as e:
+                    self.log(f"\tError running test: {current_test['name']}. Error: {e}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def run_tests_together(self, movie: Dict[str, Any], tests_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run all the tests for a movie in a single request."""
+
+        results_test = []
+        try:
+            self.log(f"\tRunning {len(tests_list)} tests in one request")
+            results = self.manager.create_many_results(self.analyzer, movie, tests_list)
+        except Exception as e:
+            self.log(f"\tError running tests. Error: {e}")
+            return results_test
+
+        for current_test, result in zip(tests_list, results):
+            try:
+                if not self.collect_result(movie, current_test, result, results_test):
+                    return None
+            except Exception as e:
+                self.log(f"\tError collecting test: {current_test['name']}. Error: {e}")
         return results_test
 
+    def collect_result(self, movie: Dict[str, Any], current_test: Dict[str, Any], result: Dict[str, Any], results_test: List[Dict[str, Any]]) -> bool:
+        """Collect a test result, or delete the movie and return False if the model has no info."""
+
+        # Check if there is info
+        if result['result'] is None:
+            # Delete movie because there is info in the model
+            self.manager.delete_movie(movie['id'])
+            return False
+
+        if self.checkpoint is not None:
+            self.checkpoint.save_result(movie['id'], result)
+        result['tests'] = current_test
+        results_test.append(result)
+        return True
+
+    def flush_results(self):
+        """Wait for the queued results to be saved, logging the ones that could not be."""
+
+        if not hasattr(self.manager, 'flush'):
+            return
+        failed = self.manager.flush()
+        movie_ids = sorted({result['movie_id'] for result in failed or []})
+        if failed:
+            self.log(f"{len(failed)} results could not be saved (movies: {', '.join(map(str, movie_ids))})")
+        if self.checkpoint is not None:
+            self.checkpoint.commit_movies(movie_ids)
+
+    def log_usage(self):
+        """Log the tokens used by the analyzer, split into cached and uncached input."""
+
+        if not hasattr(self.analyzer, 'get_usage_totals'):
+            return
+        usage = self.analyzer.get_usage_totals()
+        self.log(f"LLM usage: {usage['calls']} calls, {usage['prompt_tokens']} input tokens "
+                 f"({usage['cached_tokens']} cached, {usage['uncached_tokens']} uncached), {usage['completion_tokens']} output tokens")
+
+    def log_api_stats(self):
+        """Log the requests, retries and latency of the TMDb API by endpoint."""
+
+        if not hasattr(self.movies_api, 'get_stats'):
+            return
+        for endpoint, stats in self.movies_api.get_stats().items():
+            self.log(f"TMDb {endpoint}: {stats['requests']} requests, {stats['retries']} retries, "
+                     f"{stats['cache_hits']} cache hits, {stats['not_modified']} not modified, "
+                     f"{stats['avg_latency']:.2f}s avg, {stats['max_latency']:.2f}s max")
+
+    def log_metrics(self):
+        """Log the latency and token totals of each stage since the start of the run."""
+
+        rows = metrics.totals(self.metrics_start)
+        if rows:
+            self.log("Run metrics:")
+        for name, labels, count, total in rows:
+            labels_text = ", ".join(f"{key}={value}" for key, value in labels.items())
+            if count is None:
+                self.log(f"\t{name} [{labels_text}]: {total:g}")
+            else:
+                self.log(f"\t{name} [{labels_text}]: {count} x {total / count:.2f}s avg, {total:.1f}s total")
+
     def log_start(self):
         """Log the start of the script."""
 
+        self.metrics_start = metrics.snapshot()
         self.log('-'*50, False)
         self.log('-'*14 + ' Starting the script ' + '-'*15, False)
         self.log('-'*14 + f' {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")} ' + '-'*15, False)
         self.log('-'*50, False)
 
+    def as_completed(self, futures):
+        """Yield the futures as they complete, forwarding the queued log messages meanwhile."""
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            self.flush_log()
+            yield from done
+
+    def flush_log(self):
+        """Send the log messages queued by worker threads to the callback."""
+
+        if threading.get_ident() != self.log_thread:
+            return
+        while True:
+            try:
+                message = self.log_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.log_callback(message)
+
     def log(self, message: str, callback: bool = True):
-        """Log a message."""
+        """Log a message. Callbacks run in the thread that started the analysis (e.g. Streamlit's)."""
 
         self.logger.info(message)
         if self.log_callback and callback:
-            self.log_callback(message)
\ No newline at end of file
+            if threading.get_ident() == self.log_thread:
+                self.flush_log()
+                self.log_callback(message)
+            else:
+                self.log_queue.put(message)
\ No newline at end of file
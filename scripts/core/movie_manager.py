@@ -1,10 +1,12 @@
 import datetime
 from enum import Enum
+import threading
 import time
-from typing import Dict
+from typing import Dict, List
 
 from scripts.core.movie_analyzer import MovieAnalyzer
 from scripts.core.movie_api import MovieAPI
+from scripts.helpers.metrics import metrics
 from scripts.helpers.supabase_db import SupabaseDB
 
 class Tables(Enum):
@@ -18,12 +20,46 @@ class Tables(Enum):
         return self.value
 
 
+class Views(Enum):
+    DASHBOARD_TOTALS = 'dashboard_totals'
+    DASHBOARD_MOVIES_BY_YEAR = 'dashboard_movies_by_year'
+    DASHBOARD_RESULTS_BY_TEST = 'dashboard_results_by_test'
+    DASHBOARD_MOVIE_TESTS = 'dashboard_movie_tests'
+
+    def __str__(self):
+        return self.value
+
+
 class MovieManager:
+    # Columns of result_test written by the managers
+    result_columns = ('id', 'movie_id', 'test_id', 'result', 'reason', 'reason_es', 'execution_time', 'active', 'fingerprint')
+
+    def __init__(self, api: MovieAPI, db: SupabaseDB, write_batch_size: int = 100, write_interval: float = 2.0,
+                 write_retries: int = 3, use_rpc: bool = False, fingerprints: bool = False) -> None:
+        """Initialize the MovieManager with the given API and database.
 
-    def __init__(self, api: MovieAPI, db: SupabaseDB) -> None:
-        """Initialize the MovieManager with the given API and database."""
+        Results queued with `queue_results` are written in the background once `write_batch_size`
+        rows are pending or every `write_interval` seconds, retrying failed batches `write_retries` times.
+        With `use_rpc`, results, summaries and deletions go through the functions in scripts/sql/functions.sql.
+        With `fingerprints`, results and summaries save the fingerprint of their inputs for incremental runs,
+        which needs the columns in scripts/sql/fingerprints.sql.
+        """
         self.api = api
         self.db = db
+        self.use_rpc = use_rpc
+        self.fingerprints = fingerprints
+        self.known_genres = None
+        self.lock = threading.Lock()
+
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.write_retries = write_retries
+        self.write_buffer = []
+        self.failed_results = []
+        self.writing = False
+        self.flushing = 0
+        self.write_condition = threading.Condition()
+        self.writer = None
 
     
 
@@ -36,48 +72,81 @@ class MovieManager:
         result = self.db.read(Tables.MOVIES, {'id': movie_id})
         return result[0] if result else None
     
+    def get_existing_movies(self, movie_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Read several movies by ID in one request, with the test IDs of their active results."""
+        if not movie_ids:
+            return {}
+        with metrics.timer('supabase_request_seconds', table=str(Tables.MOVIES), operation='select'):
+            data = self.db.raw(Tables.MOVIES, "*, result_test(test_id)").in_('id', list(movie_ids)).eq('result_test.active', True).execute()
+        return {movie['id']: movie for movie in data.data}
+
     def get_total(self, table: str) -> int:
         """Get the total number of a table in the database."""
         data = self.db.raw(table, "count(*)").execute()
         total_movies = data.data[0]["count"] if data else 0
         return total_movies
 
-    def set_tests_inactive(self, movie_id: str) -> int:
-        """Set all tests inactive for a movie."""
-        return self.db.update(Tables.RESULT_TEST, {'movie_id': movie_id}, {'active': False})
+    def set_tests_inactive(self, movie_id: str, test_ids: List[str] = None) -> int:
+        """Set all tests inactive for a movie, or only the given ones."""
+        if test_ids is None:
+            return self.db.update(Tables.RESULT_TEST, {'movie_id': movie_id}, {'active': False})
+        if test_ids:
+            return self.db.update(Tables.RESULT_TEST, {'movie_id': movie_id}, {'active': False}, in_query={'test_id': list(test_ids)})
+
+    def get_active_results(self, movie_id: str) -> List[Dict[str, str]]:
+        """Read the active results of a movie, with their test."""
+        return list(self.db.iter_rows(Tables.RESULT_TEST, {'movie_id': movie_id, 'active': True},
+                                      columns='*, tests(id, name, objective, criteria)'))
+
+    def iter_incomplete_results(self):
+        """Stream the active results without a result, with their movie and test."""
+        return self.db.iter_rows(Tables.RESULT_TEST, {'result': None, 'active': True},
+                                 columns='id, movies(id, title, year), tests(id, name, criteria)')
+
+    def load_genres(self) -> None:
+        """Load the IDs of the genres already in the database."""
+        genres = self.db.read(Tables.GENRES)
+        with self.lock:
+            self.known_genres = {genre['id'] for genre in genres}
 
     def save_movie(self, movie: Dict[str, str]) -> None:
         """Save the movie to the database."""
+        return self.save_movies([movie])[0]
 
-        # Fetching movie details
-        movie_detail = self.api.fetch_movie_details(movie['id'])
-        
-        # Saving genres
-        genres = movie_detail.get('genres', [])
-        for genre in genres:
-            self.save_genres(genre)
+    def save_movies(self, movies: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Save several movies with their genres to the database, with one request per table."""
 
-        # Saving movie
-        movie['created_at'] = datetime.datetime.now().isoformat()
-        movie['tmdb_score'] = movie.pop('vote_average')
-        movie['imdb_id'] = movie_detail.get('imdb_id', None)
-        self.db.create_or_update(Tables.MOVIES, movie)
+        if self.known_genres is None:
+            self.load_genres()
 
-        # Saving movie-genre relationship
-        for genre in genres:
-            self.db.create_or_update(Tables.MOVIES_GENRES, {'movie_id': movie['id'], 'genre_id': genre['id']})
+        new_genres = {}
+        movies_genres = []
+        for movie in movies:
+            # Fetching movie details, unless the movie already comes with them
+            if 'genres' not in movie or 'imdb_id' not in movie:
+                movie_detail = self.api.fetch_movie_details(movie['id'], raw=False)
+                movie['genres'] = movie_detail['genres']
+                movie['imdb_id'] = movie_detail['imdb_id']
+            genres = movie.pop('genres')
 
-        return movie
+            movie['created_at'] = datetime.datetime.now().isoformat()
+            movie['tmdb_score'] = movie.pop('vote_average')
 
-    def save_genres(self, genre: Dict[str, str]) -> None:
-        """Save the genres of the movie to the database."""
-        try:
-            existing_obj = self.db.read(Tables.GENRES, {'id': genre['id']})
-            if not existing_obj:
-                self.db.create_or_update(Tables.GENRES, genre)
-                
-        except Exception as e:
-            print(f"Error saving genre: {str(e)}")
+            for genre in genres:
+                if genre['id'] not in self.known_genres:
+                    new_genres[genre['id']] = genre
+                movies_genres.append({'movie_id': movie['id'], 'genre_id': genre['id']})
+
+        # Saving genres, without touching the ones already saved
+        self.db.bulk_upsert(Tables.GENRES, list(new_genres.values()), ignore_duplicates=True)
+        with self.lock:
+            self.known_genres.update(new_genres)
+
+        # Saving movies and movie-genre relationships
+        self.db.bulk_upsert(Tables.MOVIES, movies)
+        self.db.bulk_upsert(Tables.MOVIES_GENRES, movies_genres, ignore_duplicates=True)
+
+        return movies
 
     def create_results(self, analyzer: MovieAnalyzer, movie: Dict[str, str], test: Dict[str, str]) -> None:
         """Save the results of the tests to the database."""
@@ -85,48 +154,182 @@ class MovieManager:
         result = analyzer.run(movie['title'], movie['year'], test['criteria'])
         end_time = time.time()
         
-        result['test_id'] = test['id']
-        result['execution_time'] = end_time - start_time
+        metrics.observe('stage_seconds', end_time - start_time, stage='test')
+        result = self.prepare_result(movie, test, result, end_time - start_time, analyzer.test_fingerprint(test['criteria']))
 
         # Translate the result
         if 'reason_es' not in result:
             print(f"Translating reason: {result['reason']}")
             result['reason_es'] = self.translate_result(analyzer, result['reason'])
-        
+
+        return result
+
+    def create_many_results(self, analyzer: MovieAnalyzer, movie: Dict[str, str], tests: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Run several tests of a movie in a single request and prepare their results, in the order of the tests."""
+        start_time = time.time()
+        results = analyzer.run_many(movie['title'], movie['year'], tests)
+        end_time = time.time()
+        metrics.observe('stage_seconds', end_time - start_time, stage='tests_together')
+
+        prepared_results = [self.prepare_result(movie, test, results[test['id']], (end_time - start_time) / len(tests),
+                                                analyzer.test_fingerprint(test['criteria'])) for test in tests]
+
+        # Translate the results without a Spanish reason in one go
+        self.translate_results(analyzer, [result for result in prepared_results if 'reason_es' not in result])
+
+        return prepared_results
+
+    def prepare_result(self, movie: Dict[str, str], test: Dict[str, str], result: Dict[str, str], execution_time: float,
+                       fingerprint: str = None) -> Dict[str, str]:
+        """Add the movie, test, execution time and fingerprint of its inputs to the result of a test."""
+        result['test_id'] = test['id']
+        result['execution_time'] = execution_time
         result['movie_id'] = movie['id']
         result['active'] = True
-
+        if self.fingerprints:
+            result['fingerprint'] = fingerprint
         return result
 
     def save_results(self, result: Dict[str, str]) -> None:
         """Save the results of the tests to the database."""
         return self.db.create_or_update(Tables.RESULT_TEST, result)
+
+    def result_rows(self, results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Keep only the columns of result_test, dropping the joined test and any extra key of the model's answer.
+
+        A stray key would fail the upsert of the whole batch the row is written with.
+        """
+        return [{key: value for key, value in result.items() if key in self.result_columns} for result in results]
+
+    def save_results_bulk(self, results: List[Dict[str, str]]) -> None:
+        """Save the results of several tests to the database in a single request."""
+        return self.db.bulk_upsert(Tables.RESULT_TEST, self.result_rows(results))
+
+    def replace_movie_results(self, analyzer: MovieAnalyzer, movie: Dict[str, str], summary: Dict[str, str] = None) -> None:
+        """Replace the active results and the summary of a movie in a single transaction, generating the summary if not given."""
+        summary = summary or self.build_summary(analyzer, movie)
+        params = {'p_movie_id': movie['id'], 'p_results': self.result_rows(movie['result_test']), 'p_summary': summary}
+        return self.db.rpc('replace_movie_results', params)
+
+    def queue_results(self, results: List[Dict[str, str]]) -> None:
+        """Queue results to be saved in the background, without waiting for the database."""
+        rows = self.result_rows(results)
+        with self.write_condition:
+            self.write_buffer.extend(rows)
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.write_worker, name="result-writer", daemon=True)
+                self.writer.start()
+            if len(self.write_buffer) >= self.write_batch_size:
+                self.write_condition.notify_all()
+
+    def write_worker(self) -> None:
+        """Background loop saving the queued results in batches."""
+        while True:
+            with self.write_condition:
+                self.write_condition.wait_for(
+                    lambda: len(self.write_buffer) >= self.write_batch_size or self.flushing,
+                    timeout=self.write_interval)
+                rows = self.write_buffer[:self.write_batch_size]
+                del self.write_buffer[:self.write_batch_size]
+                self.writing = bool(rows)
+
+            if rows:
+                self.write_rows(rows)
+
+            with self.write_condition:
+                self.writing = False
+                self.write_condition.notify_all()
+
+    def write_rows(self, rows: List[Dict[str, str]]) -> None:
+        """Save a batch of results, retrying with backoff and keeping the batch aside if it keeps failing."""
+        for attempt in range(self.write_retries + 1):
+            try:
+                self.db.bulk_upsert(Tables.RESULT_TEST, rows)
+                return
+            except Exception as e:
+                print(f"Error saving {len(rows)} results (attempt {attempt + 1}): {str(e)}")
+                if attempt < self.write_retries:
+                    time.sleep(0.5 * 2 ** attempt)
+        with self.write_condition:
+            self.failed_results.extend(rows)
+
+    def flush(self) -> List[Dict[str, str]]:
+        """Wait until every queued result is saved and return (and forget) the ones that could not be."""
+        with self.write_condition:
+            self.flushing += 1
+            self.write_condition.notify_all()
+            try:
+                self.write_condition.wait_for(
+                    lambda: not self.write_buffer and not self.writing
+                    or self.writer is None or not self.writer.is_alive())
+            finally:
+                self.flushing -= 1
+            failed, self.failed_results = self.failed_results, []
+        return failed
+
+    def discard_results(self, movie_id: str) -> None:
+        """Drop the queued results of a movie and wait for the batch being written, if any."""
+        with self.write_condition:
+            self.write_buffer = [row for row in self.write_buffer if row['movie_id'] != movie_id]
+            self.failed_results = [row for row in self.failed_results if row['movie_id'] != movie_id]
+            self.write_condition.wait_for(lambda: not self.writing)
     
     def translate_result(self, analyzer, reason: str) -> str:
         """Translate the result to Spanish."""
         try:
-            reason_es = analyzer.translate(reason, 'Spanish')
-            if 'translated' in reason_es:
-                reason_es = reason_es['translated']
+            with metrics.timer('stage_seconds', stage='translation'):
+                reason_es = analyzer.translate_batch([reason], 'Spanish')[0]
         except Exception as e:
             reason_es = None
         return reason_es
+
+    def translate_results(self, analyzer, results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Translate the reason of several results to Spanish with batched requests."""
+        if not results:
+            return results
+        try:
+            with metrics.timer('stage_seconds', stage='translation'):
+                reasons_es = analyzer.translate_batch([result['reason'] for result in results], 'Spanish')
+        except Exception as e:
+            reasons_es = [None] * len(results)
+        for result, reason_es in zip(results, reasons_es):
+            result['reason_es'] = reason_es
+        return results
     
     def create_summary(self, analyzer: MovieAnalyzer, movie: str):
         """ Generate and translate summary movie. """
+        self.db.update(Tables.MOVIES, {'id': movie['id']}, self.build_summary(analyzer, movie))
+
+    def build_summary(self, analyzer: MovieAnalyzer, movie: str) -> Dict[str, str]:
+        """ Generate the summary and score of a movie, without saving them. """
 
         movie_to_update = {
             'summary': None,
             'summary_es': None,
-            'our_score': 0
+            'our_score': 0,
         }
+        if self.fingerprints:
+            movie_to_update['summary_fingerprint'] = analyzer.summary_fingerprint(movie)
 
         count_incomplete = sum(1 for test in movie['result_test'] if test['result'] is None)
         if count_incomplete < len(movie['result_test']):
-            movie_to_update['summary'] = movie_to_update['summary_es'] = analyzer.summary(movie)
+            with metrics.timer('stage_seconds', stage='summary'):
+                movie_to_update['summary'] = movie_to_update['summary_es'] = analyzer.summary(movie)
             movie_to_update['our_score'] = self.calculate_score(movie)
+            if movie_to_update['summary'] is None and self.fingerprints:
+                # Failed summaries are never up to date
+                movie_to_update['summary_fingerprint'] = None
+
+        return movie_to_update
+
+    def reusable_summary(self, analyzer: MovieAnalyzer, movie: Dict[str, str], existing_movie: Dict[str, str]) -> Dict[str, str]:
+        """ The saved summary and score of a movie if they were generated from the same inputs, else None. """
 
-        self.db.update(Tables.MOVIES, {'id': movie['id']}, movie_to_update)
+        if not self.fingerprints or not existing_movie or not existing_movie.get('summary_fingerprint'):
+            return None
+        if existing_movie['summary_fingerprint'] != analyzer.summary_fingerprint(movie):
+            return None
+        return {key: existing_movie.get(key) for key in ('summary', 'summary_es', 'our_score', 'summary_fingerprint')}
 
     def calculate_score(self, movie) -> int:
         """ Calculate percentage of passed test. """
@@ -143,7 +346,11 @@ class MovieManager:
     def delete_movie(self, movie_id: str) -> None:
         """Delete a movie from the database."""
         print(f"Deleting movie: {movie_id}")
+        self.discard_results(movie_id)
         try:
+            if self.use_rpc:
+                self.db.rpc('delete_movie_cascade', {'p_movie_id': movie_id})
+                return True
             self.db.delete(Tables.RESULT_TEST, {'movie_id': movie_id})
             self.db.delete(Tables.MOVIES_GENRES, {'movie_id': movie_id})
             self.db.delete(Tables.MOVIES, {'id': movie_id})
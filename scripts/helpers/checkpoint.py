@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class Checkpoint:
+    def __init__(self, path: str = './cache/checkpoint.sqlite', params: dict = None):
+        """Open (or create) the journal of a bulk run, identified by its parameters.
+
+        It records the results of every (movie, test) as they finish, the status of every movie
+        (started -> processed -> done, once its results are saved) and the pages already done,
+        so an interrupted run with the same parameters can pick up where it stopped.
+        """
+        self.path = path
+        self.run_key = hashlib.sha256(json.dumps(params or {}, sort_keys=True).encode('utf-8')).hexdigest()
+        self.lock = threading.Lock()
+
+        self._create_dir(path)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_results (
+                    run_key TEXT NOT NULL,
+                    movie_id TEXT NOT NULL,
+                    test_id TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (run_key, movie_id, test_id)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_movies (
+                    run_key TEXT NOT NULL,
+                    movie_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (run_key, movie_id)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoint_pages (
+                    run_key TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    page INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (run_key, year, page)
+                )""")
+
+    def _create_dir(self, path):
+        checkpoint_dir = os.path.dirname(path)
+        if checkpoint_dir and not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def reset(self) -> None:
+        """Forget the progress of this run, to start it over."""
+        with self.lock, self.conn:
+            for table in ('checkpoint_results', 'checkpoint_movies', 'checkpoint_pages'):
+                self.conn.execute(f"DELETE FROM {table} WHERE run_key = ?", (self.run_key,))
+
+    def save_result(self, movie_id, result: dict) -> None:
+        """Record the result of a test of a movie."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoint_results (run_key, movie_id, test_id, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (self.run_key, str(movie_id), str(result['test_id']), json.dumps(result, ensure_ascii=False), time.time()))
+
+    def get_results(self, movie_id) -> dict:
+        """Read the recorded results of a movie by test ID."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT result FROM checkpoint_results WHERE run_key = ? AND movie_id = ?",
+                (self.run_key, str(movie_id))).fetchall()
+        results = [json.loads(row[0]) for row in rows]
+        return {result['test_id']: result for result in results}
+
+    def movie_status(self, movie_id) -> str:
+        """Get the status of a movie in this run, or None if it was not started."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM checkpoint_movies WHERE run_key = ? AND movie_id = ?",
+                (self.run_key, str(movie_id))).fetchone()
+        return row[0] if row else None
+
+    def set_movie_status(self, movie_id, status: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoint_movies (run_key, movie_id, status, updated_at) VALUES (?, ?, ?, ?)",
+                (self.run_key, str(movie_id), status, time.time()))
+
+    def commit_movies(self, failed_movie_ids=()) -> None:
+        """Mark the processed movies as done once their results are saved, except the ones that failed to save."""
+        failed_movie_ids = [str(movie_id) for movie_id in failed_movie_ids]
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE checkpoint_movies SET status = 'started', updated_at = ? WHERE run_key = ? AND movie_id = ?",
+                [(now, self.run_key, movie_id) for movie_id in failed_movie_ids])
+            self.conn.execute(
+                "UPDATE checkpoint_movies SET status = 'done', updated_at = ? WHERE run_key = ? AND status = 'processed'",
+                (now, self.run_key))
+
+    def is_page_done(self, year: int, page: int) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM checkpoint_pages WHERE run_key = ? AND year = ? AND page = ?",
+                (self.run_key, year, page)).fetchone()
+        return row is not None
+
+    def set_page_done(self, year: int, page: int) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoint_pages (run_key, year, page, created_at) VALUES (?, ?, ?, ?)",
+                (self.run_key, year, page, time.time()))
@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class DiskCache:
+    def __init__(self, path: str, table: str = 'cache', max_entries: int = 5000, ttl: float = None):
+        """Open (or create) a persistent key/value cache backed by SQLite.
+
+        Entries are evicted least-recently-used once `max_entries` is exceeded,
+        and expire `ttl` seconds after being written (None means never).
+        """
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        self._create_dir(path)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    def _create_dir(self, path):
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str, default=None):
+        """Get a value from the cache, or `default` if missing or expired."""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return default
+
+            self.conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        """Store a JSON-serializable value and evict the least recently used entries."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now))
+            if self.max_entries:
+                self.conn.execute(f"""
+                    DELETE FROM {self.table} WHERE key IN (
+                        SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )""", (self.max_entries,))
+
+    def delete(self, key: str) -> None:
+        """Remove a single entry from the cache."""
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
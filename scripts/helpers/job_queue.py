@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class JobQueue:
+    def __init__(self, path: str = './cache/jobs.sqlite'):
+        """Open (or create) a queue of background jobs backed by SQLite, shared by every process using `path`.
+
+        Jobs go through queued -> running -> done / failed / cancelled, and keep their log lines.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        self._create_dir(path)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    message TEXT NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS job_logs_job_id ON job_logs (job_id, id)")
+
+    def _create_dir(self, path):
+        queue_dir = os.path.dirname(path)
+        if queue_dir and not os.path.exists(queue_dir):
+            os.makedirs(queue_dir, exist_ok=True)
+
+    def _row(self, row) -> dict:
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def submit(self, kind: str, params: dict = None) -> int:
+        """Queue a job and return its ID."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, params, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(params or {}), time.time()))
+        return cursor.lastrowid
+
+    def claim(self, max_running: int = None) -> dict:
+        """Take the oldest queued job and mark it running, unless `max_running` jobs are already running."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+                row = None
+                if max_running is None or running < max_running:
+                    row = self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE id = ?",
+                        (now, now, row['id']))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._row(row)
+        job['status'] = 'running'
+        return job
+
+    def log(self, job_id: int, message: str) -> None:
+        """Add a log line to a job, which also becomes its progress message."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO job_logs (job_id, created_at, message) VALUES (?, ?, ?)",
+                (job_id, time.time(), message))
+            self.conn.execute("UPDATE jobs SET message = ? WHERE id = ?", (message, job_id))
+
+    def heartbeat(self, job_id: int) -> bool:
+        """Tell the queue the job is still alive, returning whether it was asked to cancel."""
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+            row = self.conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def finish(self, job_id: int, status: str, result=None, error: str = None) -> None:
+        """Mark a running job as done, failed or cancelled."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def cancel(self, job_id: int) -> None:
+        """Cancel a queued job right away, or ask a running one to stop."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id))
+            self.conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+    def recover(self, timeout: float = 60) -> int:
+        """Fail the running jobs whose worker stopped sending heartbeats for `timeout` seconds."""
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker stopped', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (now, now - timeout))
+        return cursor.rowcount
+
+    def get(self, job_id: int) -> dict:
+        """Read a job by its ID."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def list_jobs(self, limit: int = 50) -> list:
+        """Read the most recent jobs."""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def get_logs(self, job_id: int, limit: int = 500) -> list:
+        """Read the last log lines of a job, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT created_at, message FROM job_logs WHERE job_id = ? ORDER BY id DESC LIMIT ?",
+                (job_id, limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Metrics:
+    def __init__(self):
+        """Thread-safe registry of counters and latency summaries, labelled like Prometheus metrics."""
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+
+    def _key(self, name: str, labels: dict):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add `value` to a counter."""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a value (e.g. a latency in seconds) in a summary."""
+        key = self._key(name, labels)
+        with self.lock:
+            summary = self.summaries.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['max'] = max(summary['max'], value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the seconds spent in the block, even if it raises."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def snapshot(self) -> dict:
+        """Copy the current values, to compute the totals of a run later."""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'summaries': {key: dict(summary) for key, summary in self.summaries.items()},
+            }
+
+    def totals(self, since: dict = None) -> list:
+        """Get (name, labels, count, total) rows accumulated since a snapshot, or since the start."""
+        current = self.snapshot()
+        since = since or {'counters': {}, 'summaries': {}}
+        rows = []
+        for key, summary in sorted(current['summaries'].items()):
+            previous = since['summaries'].get(key, {'count': 0, 'sum': 0.0})
+            if summary['count'] > previous['count']:
+                rows.append((key[0], dict(key[1]), summary['count'] - previous['count'], summary['sum'] - previous['sum']))
+        for key, value in sorted(current['counters'].items()):
+            previous = since['counters'].get(key, 0)
+            if value > previous:
+                rows.append((key[0], dict(key[1]), None, value - previous))
+        return rows
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+
+        def labels_text(labels):
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+        current = self.snapshot()
+        lines = []
+        for name in sorted({key[0] for key in current['counters']}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(current['counters'].items()):
+                if metric == name:
+                    lines.append(f"{name}{labels_text(labels)} {value}")
+        for name in sorted({key[0] for key in current['summaries']}):
+            lines.append(f"# TYPE {name} summary")
+            for (metric, labels), summary in sorted(current['summaries'].items()):
+                if metric == name:
+                    lines.append(f"{name}_count{labels_text(labels)} {summary['count']}")
+                    lines.append(f"{name}_sum{labels_text(labels)} {summary['sum']}")
+            lines.append(f"# TYPE {name}_max gauge")
+            for (metric, labels), summary in sorted(current['summaries'].items()):
+                if metric == name:
+                    lines.append(f"{name}_max{labels_text(labels)} {summary['max']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write the metrics to a file in Prometheus text format, replacing it atomically."""
+        metrics_dir = os.path.dirname(path)
+        if metrics_dir and not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir, exist_ok=True)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+
+    def write_periodically(self, path: str, interval: float = 15) -> threading.Thread:
+        """Rewrite the metrics file every `interval` seconds from a background thread."""
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the metrics at http://host:port/metrics from a background thread (only to this machine by default)."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Registry shared by the whole pipeline
+metrics = Metrics()
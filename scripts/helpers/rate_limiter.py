@@ -0,0 +1,68 @@
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        """Bucket refilled at `rate_per_minute`, holding at most `capacity` units."""
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Add the units earned since the last refill."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` units (going into debt if needed) and return the seconds to wait."""
+        self.refill(now)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """Shared limiter for an API with a requests/min and (optionally) a tokens/min quota."""
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 0) -> float:
+        """Reserve one request and `tokens` tokens, returning the seconds to wait before sending."""
+        now = time.monotonic()
+        wait = 0.0
+        with self.lock:
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens and tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+        return wait
+
+    def acquire(self, tokens: float = 0) -> None:
+        """Block until a request with `tokens` tokens can be sent without exceeding the quota."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def adjust(self, tokens: float) -> None:
+        """Correct a previous reservation once the real token usage is known (negative refunds)."""
+        if not self.tokens or not tokens:
+            return
+        with self.lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens - tokens)
+
+
+# Per-minute quotas of the APIs, overridable with the config keys of the same name
+DEFAULT_QUOTAS = {'tmdb_rpm': 2400, 'openai_rpm': 500, 'openai_tpm': 200000}
+
+def build_rate_limiters(quotas: dict = None, share: int = 1):
+    """TMDb and LLM limiters for the given quotas, taking DEFAULT_QUOTAS for the ones missing.
+
+    `share` splits the quotas between the processes calling the APIs at once, e.g. the job workers.
+    """
+    quotas = dict(DEFAULT_QUOTAS, **{key: value for key, value in (quotas or {}).items() if value})
+    tmdb = RateLimiter(requests_per_minute=quotas['tmdb_rpm'] / share)
+    llm = RateLimiter(requests_per_minute=quotas['openai_rpm'] / share, tokens_per_minute=quotas['openai_tpm'] / share)
+    return tmdb, llm
@@ -1,17 +1,29 @@
 from supabase import create_client, Client
 
+from scripts.helpers.metrics import metrics
+
 class SupabaseDB:
     def __init__(self, url: str, key: str):
         self.client: Client = create_client(url, key)
 
     def create(self, table_name: str, data: dict):
         """Insert a new record into the table."""
-        response = self.client.table(table_name).insert(data).execute()
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='insert'):
+            response = self.client.table(table_name).insert(data).execute()
         return response.data
 
     def create_or_update(self, table_name: str, data: dict):
         """Insert a new record or update if exist into the table."""
-        response = self.client.table(table_name).upsert(data).execute()
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='upsert'):
+            response = self.client.table(table_name).upsert(data).execute()
+        return response.data
+
+    def bulk_upsert(self, table_name: str, rows: list, on_conflict: str = None, ignore_duplicates: bool = False):
+        """Insert or update several records of the table in a single request."""
+        if not rows:
+            return []
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='upsert'):
+            response = self.client.table(table_name).upsert(rows, on_conflict=on_conflict or "", ignore_duplicates=ignore_duplicates).execute()
         return response.data
 
     def read(self, table_name: str, query: dict = None, order_by: str = None, desc: bool = False):
@@ -21,19 +33,55 @@ class SupabaseDB:
             table = table.match(query)
         if order_by:
             table = table.order(order_by, desc=desc)
-        response = table.execute()
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='select'):
+            response = table.execute()
         return response.data
     
+    def iter_rows(self, table_name: str, query: dict = None, page_size: int = 1000, columns: str = "*", key: str = "id"):
+        """Yield every record of the table matching the query, one page at a time.
+
+        Pages are fetched by keyset on the unique `key` column (which must be among the columns),
+        so rows updated while iterating are neither skipped nor repeated. A None value in the
+        query matches NULL. It stops at the first empty page, as PostgREST may cap `page_size`.
+        The key must not be NULL, since no next page could be asked for after it.
+        """
+        last_key = None
+        while True:
+            table = self.client.table(table_name).select(columns)
+            for column, value in (query or {}).items():
+                table = table.is_(column, 'null') if value is None else table.eq(column, value)
+            if last_key is not None:
+                table = table.gt(key, last_key)
+            with metrics.timer('supabase_request_seconds', table=str(table_name), operation='select'):
+                rows = table.order(key).limit(page_size).execute().data
+            if not rows:
+                return
+            yield from rows
+            last_key = rows[-1][key]
+            if last_key is None:
+                raise ValueError(f"Cannot page {table_name} by {key}: the key of a row is NULL")
+
     def raw(self, table_name: str, select: str = "*"):
         """Create a raw query to the table."""
         return self.client.table(table_name).select(select)
 
-    def update(self, table_name: str, match_query: dict, update_data: dict):
-        """Update records in the table based on a match query."""
-        response = self.client.table(table_name).update(update_data).match(match_query).execute()
+    def update(self, table_name: str, match_query: dict, update_data: dict, in_query: dict = None):
+        """Update records in the table based on a match query. Optional in_query to match columns against lists of values."""
+        table = self.client.table(table_name).update(update_data).match(match_query)
+        for column, values in (in_query or {}).items():
+            table = table.in_(column, list(values))
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='update'):
+            response = table.execute()
         return response.data
 
     def delete(self, table_name: str, match_query: dict):
         """Delete records from the table based on a match query."""
-        response = self.client.table(table_name).delete().match(match_query).execute()
-        return response.data
\ No newline at end of file
+        with metrics.timer('supabase_request_seconds', table=str(table_name), operation='delete'):
+            response = self.client.table(table_name).delete().match(match_query).execute()
+        return response.data
+
+    def rpc(self, function_name: str, params: dict = None):
+        """Call a Postgres function exposed by PostgREST."""
+        with metrics.timer('supabase_request_seconds', table=function_name, operation='rpc'):
+            response = self.client.rpc(function_name, params or {}).execute()
+        return response.data
@@ -0,0 +1,8 @@
+-- Fingerprints of the inputs of each result and summary, used by the incremental mode (--incremental).
+-- Apply once, before functions.sql.
+
+alter table result_test add column if not exists fingerprint text;
+alter table movies add column if not exists summary_fingerprint text;
+
+-- Let PostgREST pick up the new columns
+notify pgrst, 'reload schema';
@@ -0,0 +1,42 @@
+-- Server-side functions called by MovieManager through SupabaseDB.rpc (run with --rpc-writes).
+-- Apply them once in the Supabase SQL editor, or with psql against a local Postgres + PostgREST,
+-- after fingerprints.sql.
+-- Each call runs in a single transaction, so a crashed run never leaves a movie half written.
+
+-- Replace the active results of a movie and update its summary.
+-- p_results: array of result_test rows (movie_id, test_id, result, reason, reason_es, execution_time, fingerprint)
+-- p_summary: object with summary, summary_es, our_score and summary_fingerprint
+create or replace function replace_movie_results(p_movie_id bigint, p_results jsonb, p_summary jsonb)
+returns void
+language plpgsql
+as $$
+begin
+    update result_test set active = false where movie_id = p_movie_id and active;
+
+    insert into result_test (movie_id, test_id, result, reason, reason_es, execution_time, fingerprint, active)
+    select p_movie_id, r.test_id, r.result, r.reason, r.reason_es, r.execution_time, r.fingerprint, true
+    from jsonb_populate_recordset(null::result_test, p_results) as r;
+
+    update movies m
+    set (summary, summary_es, our_score, summary_fingerprint) = (
+        select s.summary, s.summary_es, s.our_score, s.summary_fingerprint
+        from jsonb_populate_record(null::movies, p_summary) as s)
+    where m.id = p_movie_id;
+end;
+$$;
+
+-- Delete a movie with its results and genre links. Returns false if the movie did not exist.
+create or replace function delete_movie_cascade(p_movie_id bigint)
+returns boolean
+language plpgsql
+as $$
+begin
+    delete from result_test where movie_id = p_movie_id;
+    delete from movies_genres where movie_id = p_movie_id;
+    delete from movies where id = p_movie_id;
+    return found;
+end;
+$$;
+
+-- Let PostgREST pick up the new functions
+notify pgrst, 'reload schema';
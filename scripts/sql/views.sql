@@ -0,0 +1,42 @@
+-- Aggregates read by the Dashboard page, so it never downloads the result_test table.
+-- Apply them once in the Supabase SQL editor, or with psql against a local Postgres + PostgREST.
+
+-- General metrics and results totals
+create or replace view dashboard_totals as
+select
+    (select count(*) from movies) as total_movies,
+    (select count(*) from genres) as total_genres,
+    count(*) as total_results,
+    count(*) filter (where result is true) as passed,
+    count(*) filter (where result is false) as failed,
+    count(*) filter (where result is null) as incomplete
+from result_test;
+
+-- Movies by year, without the movies with no release date (the Dashboard pages this view by year)
+create or replace view dashboard_movies_by_year as
+select year, count(*) as count
+from movies
+where year is not null
+group by year;
+
+-- Results by test
+create or replace view dashboard_results_by_test as
+select
+    t.id as test_id,
+    t.name as test_name,
+    count(*) filter (where r.result is true) as passed,
+    count(*) filter (where r.result is false) as failed,
+    count(*) filter (where r.result is null) as incomplete
+from tests t
+join result_test r on r.test_id = t.id
+group by t.id, t.name;
+
+-- Movies with their number of results
+create or replace view dashboard_movie_tests as
+select m.id, m.title, m.created_at, count(r.movie_id) as test_count
+from movies m
+left join result_test r on r.movie_id = m.id
+group by m.id, m.title, m.created_at;
+
+-- Let PostgREST pick up the new views
+notify pgrst, 'reload schema';
@@ -0,0 +1,33 @@
+import argparse
+from multiprocessing import Process
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+from scripts.core.movie_jobs import MovieJobs
+from scripts.helpers.job_queue import JobQueue
+
+def work(queue_path: str, config_path: str, max_running: int):
+    MovieJobs(JobQueue(queue_path), config_path, max_running).run_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the background jobs submitted from the backoffice")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes")
+    parser.add_argument("--max-running", type=int, default=2, help="Maximum number of jobs running at once, across all workers")
+    parser.add_argument("--queue", default="./cache/jobs.sqlite", help="Path of the job queue database")
+    parser.add_argument("--config", default="./scripts/config/config.yaml", help="Path of the config file")
+    args = parser.parse_args()
+
+    processes = [Process(target=work, args=(args.queue, args.config, args.max_running), daemon=True) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    print(f"{len(processes)} workers waiting for jobs in {args.queue}")
+    for process in processes:
+        process.join()
+
+
+
+if __name__ == "__main__":
+    main()